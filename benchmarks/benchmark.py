@@ -0,0 +1,204 @@
+## Benchmarks of the simulation and analysis hot paths on canonical split-bar configurations.
+##
+##   python benchmarks/benchmark.py                      # small + medium, compare with baseline.json
+##   python benchmarks/benchmark.py --configs large --repeat 3
+##   python benchmarks/benchmark.py --save-baseline      # store the results as the new baseline
+##
+## Results go to benchmarks/results/benchmark_<time>.json; the exit code is 1 if a hot path
+## got slower (or needs more memory) than the baseline by more than --tol.
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "main")) # the tasks import as src.*, like main/run.py
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+import meep as mp
+
+from src import params, containters, simulation
+from utils import meep_utils, postprocess, telemetry
+from utils.mpi_utils import am_master, count_ranks
+from visualization.plotter import set_headless
+
+p = params.SimParams()
+con = containters.SimContainers()
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# canonical configurations: resolution and run length grow together
+CONFIGS = {
+    "small":  {"resolution": 20, "sim_time": 5,  "animations_until": 5},
+    "medium": {"resolution": 35, "sim_time": 10, "animations_until": 10},
+    "large":  {"resolution": 50, "sim_time": 20, "animations_until": 20},
+}
+
+# differences below these are noise, never regressions
+MIN_WALL_S = 0.05
+MIN_MEM_MB = 1.0
+
+def measure(label, func, repeat=1):
+    """
+    Runs func() `repeat` times and returns its result and the best run:
+    wall time, timesteps/s of the stepping inside it, peak Python/NumPy heap
+    (tracemalloc, MEEP's own field arrays are not included) and the process peak RSS.
+    tracemalloc slows the Python callbacks a little - compare only runs of this script.
+    """
+    best = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        with telemetry.task(f"benchmark_{label}") as record:
+            t0 = time.perf_counter()
+            result = func()
+            wall = time.perf_counter() - t0
+        _, py_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        run = {"wall_s": wall,
+               "timesteps": record["timesteps"],
+               "timesteps_per_s": record["timesteps"] / wall if record["timesteps"] else None,
+               "py_peak_mb": py_peak / 1024**2,
+               "peak_rss_mb": record["process_peak_rss_mb"]}
+        if best is None or run["wall_s"] < best["wall_s"]:
+            best = run
+    telemetry.clear() # the benchmark keeps its own records
+    return result, best
+
+def run_config(name, repeat=1, workdir=None):
+    """
+    Benchmarks every hot path on configuration `name` (see CONFIGS).
+    The caches are disabled, so every path does its full work.
+    """
+    p._overrides = {}
+    p.reset_to_defaults()
+    p.apply_overrides(dict(CONFIGS[name], use_cache=False, IMG_CLOSE=True))
+    p.path_to_save = workdir or tempfile.mkdtemp(prefix="split_bar_bench_")
+    p.animations_folder_path = os.path.join(p.path_to_save, "animations")
+
+    def _make_sim():
+        sim = simulation.make_sim()
+        sim.init_sim() # voxelisation is the expensive part of building a simulation
+        return sim
+
+    results = {}
+    sim, results["make_sim"] = measure("make_sim", _make_sim, repeat)
+    _, results["start_calc"] = measure("start_calc", lambda: simulation.start_calc(sim), repeat)
+    _, results["collect_e_line"] = measure(
+        "collect_e_line", lambda: meep_utils.collect_e_line(p, sim, delta_t=p.animations_step, width=5), repeat)
+    E_max, results["collect_max_field"] = measure(
+        "collect_max_field", lambda: meep_utils.collect_max_field(p, sim, delta_t=p.animations_step,
+                                                                  skip_fraction=0.15), repeat)
+    _, results["show_data_img"] = measure(
+        "show_data_img", lambda: meep_utils.show_data_img(
+            datas_arr=[con.eps_data_container, con.E_comp_data_container],
+            norm_bool=[True, False], abs_bool=[True, False], cmap_arr=["binary", "RdBu"],
+            alphas=[1.0, 0.9], name_to_save=os.path.join(p.path_to_save, "bench_show_data_img"),
+            IMG_CLOSE=True), repeat)
+
+    # the cost of the task_4 post-processing only depends on the map size,
+    # so the final field stands in for the reference map
+    E_ref = np.abs(con.E_comp_data_container)
+    def _task_4_postprocess():
+        gain = postprocess.gain_map(E_max, E_ref)
+        postprocess.percentile_clip(gain, 1, 99)
+        postprocess.percentile_clip(postprocess.to_db(gain), 1, 99)
+    _, results["task_4_postprocess"] = measure("task_4_postprocess", _task_4_postprocess, repeat)
+
+    p._overrides = {}
+    p.reset_to_defaults()
+    return results
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "meep": getattr(mp, "__version__", None),
+            "ranks": count_ranks()}
+
+def compare(results, baseline, tol=0.2):
+    """
+    Lists the hot paths whose wall time or peak memory exceeds the baseline by more than
+    the relative tolerance `tol` (configurations/paths missing in the baseline are skipped).
+    """
+    regressions = []
+    for config, paths in results.items():
+        for path, run in paths.items():
+            base = baseline.get(config, {}).get(path)
+            if base is None:
+                continue
+            for key, slack in (("wall_s", MIN_WALL_S), ("py_peak_mb", MIN_MEM_MB)):
+                if run[key] > base[key] * (1 + tol) and run[key] - base[key] > slack:
+                    regressions.append(f"{config}/{path}: {key} {run[key]:.3g} vs baseline {base[key]:.3g} "
+                                       f"(+{100 * (run[key] / max(base[key], 1e-12) - 1):.0f}%)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the split-bar simulation and analysis hot paths.")
+    parser.add_argument("--configs", nargs="+", default=["small", "medium"], choices=list(CONFIGS))
+    parser.add_argument("--repeat", type=int, default=1, help="runs per hot path, the fastest counts")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tol", type=float, default=0.2, help="accepted relative slowdown / memory growth")
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args(argv)
+
+    # figures are rendered to files only, without the display pause of the plotting helpers
+    set_headless()
+
+    results = {name: run_config(name, repeat=args.repeat) for name in args.configs}
+    if not am_master():
+        return 0
+
+    report = {"environment": environment(), "results": results}
+    os.makedirs(args.out, exist_ok=True)
+    out_file = os.path.join(args.out, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out_file, "w") as f:
+        json.dump(report, f, indent=2)
+    for config, paths in results.items():
+        for path, run in paths.items():
+            rate = f"{run['timesteps_per_s']:.0f} steps/s" if run["timesteps_per_s"] else ""
+            print(f"{config:>7} {path:<20} {run['wall_s']:9.3f} s {run['py_peak_mb']:9.1f} MB  {rate}")
+    print(f"Results written to {out_file}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"environment": report["environment"], "results": baseline}, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline} - run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["environment"].get("ranks") != report["environment"]["ranks"]:
+        print("Warning: baseline was recorded with a different number of MPI ranks.")
+    regressions = compare(results, baseline["results"], tol=args.tol)
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    if not regressions:
+        print(f"No regressions against the baseline (tol {args.tol:.0%}).")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
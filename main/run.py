@@ -1,44 +1,136 @@
-import sys, os, meep
+## Command-line entry point. A run is a set of tasks (stages of src/pipeline.py) plus
+## parameter overrides, given on the command line or in a JSON configuration file.
+## Only out-of-date stages run; MEEP and matplotlib are only imported once one does:
+##
+##   python main/run.py                                    # task 0 and task 4 (DEFAULT_STAGES)
+##   python main/run.py --config main/configs/split_bar.json
+##   python main/run.py --tasks 2 3 --set gap_size=0.02    # task 0 is added (and skipped if up to date)
+##   python main/run.py --dry-run --set dimensions=3 --set z_height=0.04 --set substrate=SiO2
+import sys, os, json, math, argparse
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.taskManager import *
-from utils.sys_utils import *
+from src import params, pipeline
 
-def run():
-    
-    ### Set paths to save results
-    SIM_NAME = "Au_src_c.200_s.040_res.50_wl.1000nm"
-    #############################
-    
-    p.path_to_save = os.path.join("results", SIM_NAME)
-    p.animations_folder_path = os.path.join(p.path_to_save, "animations")
+p = params.SimParams()
+
+### Default name of the results directory
+SIM_NAME = "Au_src_c.200_s.040_res.50_wl.1000nm"
+
+DEFAULT_STAGES = {"task_0": {}, "task_4": {}}
+
+def parse_overrides(assignments):
+    """
+    "name=value" strings -> overrides dict. Values are read as JSON where possible
+    (numbers, true/false, null, lists), anything else stays a string (e.g. material=Ag).
+    """
+    overrides = {}
+    for item in assignments:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected name=value, got '{item}'.")
+        try:
+            overrides[name.strip()] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[name.strip()] = value
+    return overrides
+
+def dry_run(stages, force=False):
+    """
+    Prints the resolved parameters, the derived grid and the planned stages (no MEEP needed).
+    """
+    nx, ny, nz = p.grid_shape()
+    timesteps = math.ceil(max(p.sim_time, p.animations_until) * p.resolution / p.Courant_factor)
+    print(f"Simulation parameters (hash {p.params_hash()[:12]}):")
+    for line in p.describe():
+        print(f"  {line}")
+    print(f"Grid ({p.dimensions}D): {nx} x {ny}" + (f" x {nz}" if p.dimensions == 3 else "")
+          + f" cells = {nx * ny * nz:.3g} points at resolution {p.resolution}, "
+          f"dt = {p.animations_step:.3g}, ~{timesteps} time steps per run")
+    print(f"Planned stages (results in {p.path_to_save}):")
+    for name, entry in pipeline.plan(stages, force=force).items():
+        args = ", ".join(f"{k}={v!r}" for k, v in entry["kwargs"].items())
+        after = f" after {', '.join(entry['after'])}" if entry["after"] else ""
+        print(f"  {'run       ' if entry['run'] else 'up to date'}  {name}({args}){after}"
+              f" - {pipeline.STAGES[name].description}")
 
-    #--- Task 0 ---
-    print_task(0, "Triggering calculations and saving the most general results.")
-    sim = task_0()
-
-    # #--- Task 1 ---
-    # print_task(1, "Making medium - a split bar antenna.")
-    # task_1()
-    
-    # #--- Task 2 ---
-    # print_task(2, "Plotting the dielectric constant of a system.")
-    # task_2(plot=False)
-
-    # #--- Task 3 ---
-    # print_task(3, "Plotting the scalar electric field E component.")
-    # task_3(plot=True, animation=True, animation_name="with_antennas", plot_3D=True, sim=sim)
-
-    # #--- Task 3 ---
-    # print_task(3, "WITHOUT ANTENNAS; Plotting the scalar electric field E component.")
-    # p.center = [mp.Vector3(-9999, -9999, -9999), # upper bar
-    #             mp.Vector3(-9999, -9999, -9999)] # lower bar
-    # task_3(plot=False, animation=True, animation_name="without_antennas", plot_3D=True, recalculate=True)
+def run(stages=DEFAULT_STAGES, workers=1, force=False):
+    pipeline.run_pipeline(stages, workers=workers, force=force)
+
+    # #--- Checkpoints (p.checkpoint_interval = 5 before task_0) ---
+    # from src import simulation, taskManager
+    # sim = taskManager.task_0()
+    # simulation.extend_calc(sim, extra_time=20)                 # continue task_0 instead of restarting
+    # taskManager.task_3(animation=True, animation_name="steady_state", from_checkpoint=True)
+
+    # #--- Animation from a saved frame store (task_3 with store_frames=true), no re-simulation ---
+    # from utils.video import render_store
+    # render_store(os.path.join(p.path_to_save, "frames_E_with_antennas"),
+    #              os.path.join(p.animations_folder_path, "with_antennas_stream.mp4"), fps=p.animations_fps)
+
+    # #--- Task 3 without antennas ---
+    # from src import taskManager
+    # p.bar_centers = [[-9999, -9999, -9999], # upper bar
+    #                  [-9999, -9999, -9999]] # lower bar
+    # taskManager.task_3(plot=False, animation=True, animation_name="without_antennas", plot_3D=True, recalculate=True)
     # p.reset_to_defaults()
-    
-    #--- Task 4 ---
-    print_task(4, "Magnitude of the electric field with and without antennas.")
-    task_4(E_plot = True)
-    
+
+    # #--- Parameter sweep ---
+    # from src.sweep import run_sweep, make_grid
+    # run_sweep(make_grid(gap_size=[0.02, 0.05, 0.1], x_width=[0.5, 0.7]),
+    #           task="task_4", root=os.path.join("results", "sweep_gap_size"))
+
+    # #--- Resolution study ---
+    # from src.resolution_study import run_resolution_study
+    # run_resolution_study(resolutions=[25, 35, 50, 70, 100], tol=0.02)
+
+    # #--- 3D split bar: --set dimensions=3 --set z_height=0.04 --set substrate=SiO2 --set resolution=25
+    # from src import simulation
+    # print(simulation.estimate_resources())
+
+    # timesteps/s of every run of this process, appended per `mpirun -np N` invocation
+    from utils.mpi_utils import write_scaling_report
+    write_scaling_report(os.path.join(p.path_to_save, "scaling_report.json"))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split-bar antenna simulations.")
+    parser.add_argument("--config", help="JSON run configuration, see src/pipeline.py:load_config()")
+    parser.add_argument("--tasks", nargs="+", choices=[name[len("task_"):] for name in pipeline.STAGES],
+                        help="tasks to run (replaces the stages of the configuration)")
+    parser.add_argument("--name", help=f"results directory below results/ (default {SIM_NAME})")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a simulation parameter (repeatable, wins over the configuration)")
+    parser.add_argument("--workers", type=int, help="stages run at the same time (default 1)")
+    parser.add_argument("--force", action="store_true", help="run every stage, even if it is up to date")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the parameters, grid and planned stages without running anything")
+    args = parser.parse_args(argv)
+
+    try:
+        config = pipeline.load_config(args.config) if args.config else {}
+        overrides = dict(config.get("params", {}), **parse_overrides(args.overrides))
+        if overrides:
+            p.apply_overrides(overrides)
+    except (OSError, ValueError, AttributeError) as e:
+        parser.error(str(e))
+    name = args.name or config.get("name") or SIM_NAME
+    p.path_to_save = os.path.join("results", name)
+    p.animations_folder_path = os.path.join(p.path_to_save, "animations")
+
+    if args.tasks:
+        stages = {f"task_{number}": {} for number in args.tasks}
+    else:
+        stages = config.get("stages") or DEFAULT_STAGES
+    workers = args.workers or config.get("workers", 1)
+    try:
+        pipeline.plan(stages)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.dry_run:
+        dry_run(stages, force=args.force)
+    else:
+        run(stages, workers=workers, force=args.force)
+    return 0
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,103 @@
+## On-disk cache of computed fields, keyed by a hash of the parameters they depend on
+import os
+import json
+import hashlib
+import numpy as np
+
+from . import params
+from .params import to_jsonable
+from utils.mpi_utils import am_master, broadcast_flag
+from utils import telemetry
+from utils import async_io
+
+# inicialize singleton of all parameters
+p = params.SimParams()
+
+# Parameters that determine the empty-cell (reference) fields, besides the cell (see reference_key()).
+# The antenna geometry (x_width, y_length, gap_size, material, center) is deliberately absent,
+# the substrate stays in the reference cell.
+REFERENCE_PARAMS = ("dimensions", "cell_size", "substrate", "output_center", "output_size",
+                    "lambda0", "freq", "freq_width", "component", "source_type",
+                    "xyz_src", "src_size", "Courant_factor", "pml", "resolution",
+                    "adaptive_stop", "convergence_tol", "convergence_periods", "max_sim_time")
+
+# Parameters that fully determine the voxelised structure (independent of the source).
+GEOMETRY_PARAMS = ("dimensions", "xyz_cell", "substrate", "x_width", "y_length", "z_height", "gap_size",
+                   "pad", "pad_z", "center", "material", "pml", "resolution", "Courant_factor")
+
+def params_hash(keys, extra=None):
+    """
+    Returns a short sha256 hash of the selected parameters (and optional extra values).
+
+    Args:
+        keys (iterable of str): Names of SimParams attributes to include.
+        extra (dict): Additional values the cached result depends on (e.g. run time, delta_t).
+    """
+    payload = {k: to_jsonable(getattr(p, k)) for k in keys}
+    if extra:
+        payload.update({k: to_jsonable(v) for k, v in extra.items()})
+    blob = json.dumps(payload, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+def results_key(**extra):
+    """
+    Hash key of results that depend on all physical parameters (e.g. the antenna fields).
+    """
+    return p.params_hash(extra)[:16]
+
+def reference_key(**extra):
+    """
+    Hash key of the empty-cell reference field for the current parameters.
+
+    The reference depends on the source, the grid and the cell, not on the bars. With a fixed
+    p.cell_size (set by run_sweep()) the key is the same for every antenna geometry; with the
+    default cell (bars + pad) the cell itself follows x_width, y_length and gap_size, so the
+    derived xyz_cell is part of the key. A 3D substrate starts below the bars, so then z_height
+    is part of it too.
+    """
+    extra = dict(extra)
+    if p.cell_size is None:
+        extra["_xyz_cell"] = p.xyz_cell
+    if p.dimensions == 3 and p.substrate is not None:
+        extra["_z_height"] = p.z_height
+    return params_hash(REFERENCE_PARAMS, extra)
+
+def structure_key(**extra):
+    """
+    Hash key of the structure / epsilon grid for the current geometry.
+    """
+    return params_hash(GEOMETRY_PARAMS, extra)
+
+def cache_path(kind, key, ext="npz"):
+    return os.path.join(p.cache_dir, f"{kind}_{key}.{ext}")
+
+def load(kind, key):
+    """
+    Returns the cached arrays as a dict, or None if not cached (or caching is disabled).
+    Whether it is cached is decided on master, so all ranks take the same (collective) path.
+    """
+    fname = cache_path(kind, key)
+    if not p.use_cache or not broadcast_flag(os.path.exists(fname)):
+        return None
+    with np.load(fname) as data:
+        return {k: data[k] for k in data.files}
+
+@telemetry.stage("io")
+def save(kind, key, **arrays):
+    """
+    Stores arrays in the cache (in the background if utils.async_io is enabled).
+    The file is written atomically so concurrent sweep workers never see a partially
+    written entry.
+    """
+    if not p.use_cache or not am_master():
+        return None
+    os.makedirs(p.cache_dir, exist_ok=True)
+    fname = cache_path(kind, key)
+    arrays = {k: np.array(v) for k, v in arrays.items()}
+    async_io.submit(_write_atomic, fname, arrays)
+    return fname
+
+def _write_atomic(fname, arrays):
+    tmp_name = f"{fname[:-4]}.{os.getpid()}.{id(arrays)}.tmp.npz"
+    np.savez(tmp_name, **arrays)
+    os.replace(tmp_name, fname)
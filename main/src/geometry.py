@@ -11,6 +11,8 @@ def make_cell():
 
 # waveguide geometry
 def make_medium():
+    if p.dimensions == 3 and p.z_height <= 0:
+        raise ValueError("3D mode needs finite-thickness bars - set z_height > 0.")
     geometry = [
         mp.Block(
             mp.Vector3(p.x_width, p.y_length, p.z_height),
@@ -24,4 +26,16 @@ def make_medium():
             material = p.material,
         )
     ]
+
+    if p.dimensions == 3 and p.substrate is not None:
+        # half-space below the bars (through the PML, so it does not reflect there)
+        z_top = -p.z_height / 2.0
+        z_bottom = -p.xyz_cell[2] / 2.0
+        geometry.append(
+            mp.Block(
+                mp.Vector3(mp.inf, mp.inf, z_top - z_bottom),
+                center = mp.Vector3(0, 0, (z_top + z_bottom) / 2.0),
+                material = p.substrate,
+            )
+        )
     return geometry
\ No newline at end of file
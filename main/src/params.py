@@ -1,8 +1,99 @@
 ## Singleton of parameters
+## MEEP is only imported when a MEEP object is needed (materials, components and bar
+## centres are stored as plain values), so the parameters can be listed without it
 import os
+import sys
+import json
+import hashlib
 import numpy as np
-import meep as mp
-from meep.materials import Au, Cr, W, SiO2, Ag
+from utils.mpi_utils import master_only
+
+# Parameters recomputed by SimParams.update_derived()
+DERIVED_PARAMS = ("xyz_cell", "bar_centers", "center", "freq", "freq_width", "animations_step")
+
+# Field components that can be stored by name in SimParams.component_name
+COMPONENT_NAMES = ("Ex", "Ey", "Ez", "Er", "Ep", "Hx", "Hy", "Hz", "Hr", "Hp",
+                   "Dx", "Dy", "Dz", "Dr", "Dp", "Bx", "By", "Bz", "Br", "Bp")
+
+# Parameters that do not influence any computed field (excluded from result hashes)
+NON_PHYSICAL_PARAMS = ("IMG_CLOSE", "path_to_save", "animations_folder_path", "animations_fps",
+                       "use_cache", "cache_dir", "checkpoint_interval", "max_memory_gb",
+                       "async_output", "output_workers", "output_queue_size",
+                       "headless", "render_processes", "stream_animations",
+                       "history_decimation")
+
+def material_name(material):
+    """
+    Name of a meep.materials medium (e.g. "Au"), or None for custom media.
+    """
+    import meep.materials
+    for name, value in vars(meep.materials).items():
+        if value is material and not name.startswith('_'):
+            return name
+    return None
+
+def resolve_medium(medium):
+    """
+    Medium for a meep.materials name (e.g. "Au"); media and None are returned unchanged.
+    """
+    if isinstance(medium, str):
+        import meep.materials
+        return getattr(meep.materials, medium)
+    return medium
+
+def medium_spec(medium):
+    """
+    Inverse of resolve_medium(): the name of a meep.materials medium, otherwise the value itself.
+    """
+    if medium is None or isinstance(medium, str):
+        return medium
+    return material_name(medium) or medium
+
+def to_jsonable(value):
+    """
+    Converts a parameter value to plain JSON types without loss:
+    mp.Vector3 -> {"Vector3": [x, y, z]}, meep.materials media -> {"material": "Au"}.
+    """
+    mp = sys.modules.get("meep") # without meep imported there are no MEEP objects to convert
+    if mp is not None and isinstance(value, mp.Vector3):
+        return {"Vector3": [float(value.x), float(value.y), float(value.z)]}
+    if mp is not None and isinstance(value, mp.Medium):
+        name = material_name(value)
+        return {"material": name} if name is not None else {"medium": repr(value)}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return repr(value)
+
+def from_jsonable(value):
+    """
+    Inverse of to_jsonable().
+    """
+    if isinstance(value, dict):
+        if "Vector3" in value:
+            import meep as mp
+            return mp.Vector3(*value["Vector3"])
+        if "material" in value:
+            return resolve_medium(value["material"])
+        if "medium" in value:
+            raise ValueError(f"Cannot restore parameter value {value}.")
+        return {k: from_jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [from_jsonable(v) for v in value]
+    return value
+
+def natural_cell(x_width, y_length, gap_size, z_height, pad, pad_z, dimensions):
+    """
+    Cell enclosing the two bars with `pad` around them (and `pad_z` above and below in 3D).
+    """
+    return [x_width + 2*pad,
+            2*y_length + gap_size + 2*pad,
+            z_height + 2*pad_z if dimensions == 3 else 0]
 
 class SimParams:
     _instance=None
@@ -16,29 +107,31 @@ class SimParams:
     def _init_parameters(self):
         # SYSTEM
         self.IMG_CLOSE =  True
+        self.headless  =  False   # render figures to files only (Agg backend, no windows or pauses)
+        self.render_processes = 0 # headless: draw the figures of a task in this many processes (0 = inline)
 
         # Geometry
-        self.material   =   Au
+        self.dimensions =   2       # 2 (bars infinite in z) or 3 (finite-thickness bars)
+        self.material   =   "Au"    # meep.materials name or mp.Medium, see the material property
+        self.substrate  =   None    # 3D only: medium filling the half-space below the bars, e.g. "SiO2"
         
         self.x_width    =   0.7
         self.y_length   =   0.19
-        self.z_height   =   0.0
+        self.z_height   =   0.0     # bar thickness, must be > 0 in 3D
         self.gap_size   =   0.05
         self.pad        =   2.0
+        self.pad_z      =   1.0     # 3D only: space above and below the bars (incl. PML)
+        self.cell_size  =   None    # fixed [x, y, z] cell (None = bars + pad, see update_derived())
         
-        self.xyz_cell   =   [self.x_width+2*self.pad,
-                            2*self.y_length + self.gap_size + 2*self.pad,
-                            0]
-        self.center     =   [mp.Vector3(0, self.y_length/2.0 + self.gap_size/2.0, 0), # upper bar
-                            mp.Vector3(0, (-1)*(self.y_length/2.0 + self.gap_size/2.0), 0)] # lower bar
+        # xyz_cell and bar_centers are derived - see update_derived()
         # self.center     =   [mp.Vector3(0, 0, -10.), # upper bar
                             # mp.Vector3(0, 0, -10.)] # lower bar
         
         # Source
         self.lambda0    =   1.0 #um
-        self.freq       =   1.0 / self.lambda0
-        self.freq_width =   self.freq * 0.5
-        self.component  =   mp.Ey
+        # freq and freq_width are derived - see update_derived()
+        self.component  =   "Ey"
+        self.source_type =  "continuous" # "continuous" or "gaussian" (broadband pulse)
         self.xyz_src    =   [-2, 0.0, 0.0]
         self.src_size   =   [0, 4.4, 0.0]
         
@@ -47,49 +140,206 @@ class SimParams:
         self.pml                    =   0.25
         # self.pml                    =   (self.lambda0 + self.lambda0*0.5 ) / 2 #Should be: d_PML = lambda_max / 2
         self.resolution             =   50
+        self.use_symmetry           =   True    # exploit mirror symmetries when geometry and source allow
         self.sim_time               =   20
-        self.animations_step        =   self.Courant_factor * (1 / self.resolution) # From dt = S * dx / c, where c=1 in MEEP units
+        # animations_step is derived - see update_derived()
         self.animations_until       =   10
+        self.adaptive_stop          =   False   # stop runs once the gap-centre amplitude reached steady state
+        self.convergence_tol        =   1e-3    # relative period-to-period change of the probe amplitude
+        self.convergence_periods    =   3       # number of consecutive periods below tolerance
+        self.max_sim_time           =   200     # hard limit of adaptive runs
         self.animations_fps         =   10
+        self.stream_animations      =   False   # pipe NumPy colour-mapped frames to ffmpeg instead of mp.Animate2D
+        self.history_decimation     =   None    # reduction of stored frame histories, e.g. {"time_stride": 4, "block": 2, "dtype": "float16"}
+        self.spectral_nfreq         =   21      # number of DFT frequencies in the spectral mode
+        self.spectral_decay_tol     =   1e-6    # pulse runs stop when fields decayed by this factor
         self.path_to_save           =   "results/"
         self.animations_folder_path =   os.path.join(self.path_to_save, "animations")
+        self.checkpoint_interval    =   None    # dump the field state every this much time (None = off)
+        self.output_center          =   None    # centre of the region all collectors read (None = default, see output_volume())
+        self.output_size            =   None    # its size - a zero entry makes it a plane
+        self.max_memory_gb          =   None    # refuse to build simulations estimated to need more (None = no limit)
+        self.async_output           =   True    # write npz / PNG / mp4 files in background threads
+        self.output_workers         =   2
+        self.output_queue_size      =   8       # pending writes before the tasks wait for the disk
+        self.use_cache              =   True
+        self.cache_dir              =   os.path.join("results", ".cache")
+
+        self.update_derived()
+
+    def update_derived(self):
+        """
+        Recomputes the parameters that depend on the geometry, source and grid settings
+        (xyz_cell, bar_centers, freq, freq_width, animations_step).
+        """
+        self.xyz_cell   =   list(self.cell_size) if self.cell_size is not None else natural_cell(
+                            self.x_width, self.y_length, self.gap_size, self.z_height,
+                            self.pad, self.pad_z, self.dimensions)
+        self.bar_centers =  [[0, self.y_length/2.0 + self.gap_size/2.0, 0], # upper bar
+                            [0, (-1)*(self.y_length/2.0 + self.gap_size/2.0), 0]] # lower bar
+        self.freq       =   1.0 / self.lambda0
+        self.freq_width =   self.freq * 0.5
+        self.animations_step = self.Courant_factor * (1 / self.resolution) # From dt = S * dx / c, where c=1 in MEEP units
+
+    # MEEP views of the plain stored values (material_name, substrate_name,
+    # component_name, bar_centers); the setters also accept the MEEP objects
+    @property
+    def material(self):
+        return resolve_medium(self.material_name)
+
+    @material.setter
+    def material(self, value):
+        self.material_name = medium_spec(value)
+
+    @property
+    def substrate(self):
+        return resolve_medium(self.substrate_name)
+
+    @substrate.setter
+    def substrate(self, value):
+        self.substrate_name = medium_spec(value)
+
+    @property
+    def component(self):
+        if not isinstance(self.component_name, str):
+            return self.component_name
+        import meep as mp
+        return getattr(mp, self.component_name)
+
+    @component.setter
+    def component(self, value):
+        if not isinstance(value, str):
+            import meep as mp
+            value = next((name for name in COMPONENT_NAMES if getattr(mp, name) == value), value)
+        self.component_name = value
+
+    @property
+    def center(self):
+        import meep as mp
+        return [mp.Vector3(*c) for c in self.bar_centers]
+
+    @center.setter
+    def center(self, value):
+        self.bar_centers = [[c.x, c.y, c.z] if hasattr(c, "x") else list(c) for c in value]
+
+    def grid_shape(self):
+        """
+        Number of grid cells along x, y and z (1 along the unused z in 2D).
+        """
+        return [max(1, int(round(size * self.resolution))) for size in self.xyz_cell]
+
+    def output_volume(self):
+        """
+        Region read by the field collectors, observers and DFT monitors.
+        Defaults to the whole cell in 2D and to the z=0 plane through the middle of the
+        bars in 3D (a full 3D volume per time step would exhaust the memory); set
+        output_center / output_size for another plane or a sub-volume.
+
+        Returns:
+            center (mp.Vector3), size (mp.Vector3)
+        """
+        import meep as mp
+        if self.output_size is not None:
+            size = mp.Vector3(*self.output_size)
+        elif self.dimensions == 3:
+            size = mp.Vector3(self.xyz_cell[0], self.xyz_cell[1], 0)
+        else:
+            size = mp.Vector3(*self.xyz_cell)
+        center = mp.Vector3() if self.output_center is None else mp.Vector3(*self.output_center)
+        return center, size
+
+    def apply_overrides(self, overrides):
+        """
+        Sets the given parameters and recomputes the derived ones.
+        The overrides are remembered and re-applied by reset_to_defaults().
+
+        Args:
+            overrides (dict): Mapping of parameter name -> value, e.g. {"gap_size": 0.02}.
+        """
+        for k, v in overrides.items():
+            # checked without hasattr(), which would resolve the MEEP properties
+            if k.startswith('_') or not (k in vars(self) or isinstance(getattr(type(self), k, None), property)):
+                raise AttributeError(f"Unknown simulation parameter '{k}'.")
+            setattr(self, k, v)
+        self._overrides = dict(getattr(self, "_overrides", {}), **overrides)
+        self.update_derived()
+        # explicitly overridden derived parameters win over the recomputed ones
+        for k in DERIVED_PARAMS:
+            if k in overrides:
+                setattr(self, k, overrides[k])
 
     def reset_to_defaults(self):
         dir_nam_con = self.path_to_save
         dir_ani_con = self.animations_folder_path
+        overrides = getattr(self, "_overrides", {})
         
         self._init_parameters()
         
         self.path_to_save = dir_nam_con
         self.animations_folder_path = dir_ani_con
+        if overrides:
+            self.apply_overrides(overrides)
         
-    def showParams(self):
-        print("\n\n#################################\nSimulation and System Parameters:\n")
+    def describe(self):
+        """
+        Human readable "name=value" lines of all public parameters (long lists shortened).
+        """
+        lines = []
         for k, v in self.__dict__.items():
             if not k.startswith('_'):
-                if not isinstance(v, (list, dict, tuple, np.ndarray)): #
-                    print(f"{k}={v}")
+                if not isinstance(v, (list, tuple, np.ndarray)):
+                    lines.append(f"{k}={v}")
                 else:
-                    print(f"{k}={v[:5]}")
+                    lines.append(f"{k}={v[:5]}")
+        return lines
+
+    @master_only
+    def showParams(self):
+        print("\n\n#################################\nSimulation and System Parameters:\n")
+        print("\n".join(self.describe()))
         print("#################################\n\n")
 
+    def to_dict(self):
+        """
+        Lossless, JSON-serialisable dict of all public parameters.
+        """
+        return {k: to_jsonable(v) for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    def params_hash(self, extra=None):
+        """
+        sha256 of all parameters that influence the computed fields (NON_PHYSICAL_PARAMS excluded),
+        plus optional extra values such as the stage name.
+        """
+        payload = {k: v for k, v in self.to_dict().items() if k not in NON_PHYSICAL_PARAMS}
+        if extra:
+            payload["_extra"] = to_jsonable(extra)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def loadParams(self, filename):
+        """
+        Restores parameters written by saveParams() (the .json file).
+        """
+        with open(filename) as f:
+            data = json.load(f)
+        for k, v in data["params"].items():
+            setattr(self, k, from_jsonable(v))
+
+    @master_only
     def saveParams(self, filename="results/simulation_params.txt"):
         """
-        Saves simulation/system parameters to a file.
+        Saves simulation/system parameters to a file. Next to the human readable
+        text file a lossless machine readable <name>.json (with the parameter hash) is written.
 
         Args:
             filename (str): Nazwa pliku, do którego zostaną zapisane parametry.
         """
+        with open(os.path.splitext(filename)[0] + ".json", "w") as f:
+            json.dump({"params_hash": self.params_hash(), "params": self.to_dict()}, f, indent=2)
+
         with open(filename, "w") as f:
             header = "\n\n#################################\nSimulation and System Parameters:\n"
             f.write(header)
-            for k, v in self.__dict__.items():
-                if not k.startswith('_'):
-                    if not isinstance(v, (list, dict, tuple, np.ndarray)):
-                        line = f"{k}={v}\n"
-                        f.write(line)
-                    else:
-                        line = f"{k}={str(v[:5])}\n"
-                        f.write(line)
+            for line in self.describe():
+                f.write(line + "\n")
             footer = "#################################\n\n"
             f.write(footer)
\ No newline at end of file
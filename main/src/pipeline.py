@@ -0,0 +1,276 @@
+## Declarative task graph: every task declares the files it reads and writes (relative to
+## p.path_to_save), a scheduler runs only the out-of-date stages - independent ones in
+## parallel worker processes. Importing this module does not import MEEP.
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from . import params
+from .sweep import _init_worker
+from utils.mpi_utils import broadcast_flag, count_ranks, master_only
+from utils.sys_utils import print_task
+
+# inicialize singleton of all parameters
+p = params.SimParams()
+
+STATE_FILE = "pipeline_state.json"
+
+# keys of a run configuration file, see load_config()
+CONFIG_KEYS = ("name", "params", "workers", "stages")
+
+class Stage:
+    """
+    Declaration of a task of taskManager.
+
+    Args:
+        description (str): Shown when the stage runs.
+        inputs (tuple of str): Files the task reads, relative to p.path_to_save.
+        outputs (tuple of str): Files the task writes; may refer to its arguments,
+                                e.g. "data_E_line_{animation_name}.npz".
+        defaults (dict): Task arguments used unless the configuration sets them.
+        params (tuple of str): Parameters outside params_hash() (NON_PHYSICAL_PARAMS)
+                               that still change the outputs, see stage_key().
+    """
+    def __init__(self, description, inputs=(), outputs=(), defaults=None, params=()):
+        self.description = description
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.defaults = dict(defaults or {})
+        self.params = tuple(params)
+
+    def input_files(self, kwargs):
+        return [f.format(**kwargs) for f in self.inputs]
+
+    def output_files(self, kwargs):
+        return [f.format(**kwargs) for f in self.outputs]
+
+# the tasks, in their default order; a file read by a stage is produced by the first stage
+# declaring it as an output, unless the run plans another one
+STAGES = {
+    "task_0": Stage("Triggering calculations and saving the most general results.",
+                    outputs=("data_general.npz",)),
+    "task_1": Stage("Making medium - a split bar antenna.",
+                    outputs=("2Dplot.png",)),
+    "task_2": Stage("Plotting the dielectric constant of a system.",
+                    inputs=("data_general.npz",), outputs=("Epsilon.png",),
+                    defaults={"plot": True}),
+    "task_3": Stage("Plotting the scalar electric field E component.",
+                    inputs=("data_general.npz",), outputs=("data_E_line_{animation_name}.npz",),
+                    defaults={"plot": True, "animation": True, "animation_name": "with_antennas", "plot_3D": True},
+                    params=("history_decimation", "stream_animations", "animations_fps")),
+    "task_4": Stage("Magnitude of the electric field with and without antennas.",
+                    outputs=("data_enhancement.npz",),
+                    defaults={"E_plot": True}),
+    "task_5": Stage("Single-pass analysis: fields, line profile, max field and animation from one run.",
+                    outputs=("data_general.npz", "data_E_line_{animation_name}.npz",
+                             "data_max_field_{animation_name}.npz"),
+                    defaults={"animation": True, "animation_name": "with_antennas", "plot_3D": True},
+                    params=("history_decimation", "stream_animations", "animations_fps")),
+    "task_6": Stage("Broadband enhancement spectrum from a single pulsed run.",
+                    outputs=("data_spectral_enhancement.npz",),
+                    defaults={"E_plot": True}),
+}
+
+def load_config(filename):
+    """
+    Reads a JSON run configuration:
+
+        {"name": "Au_gap_20nm",                     # results/<name>
+         "params": {"gap_size": 0.02},              # SimParams overrides
+         "workers": 2,                              # parallel stages
+         "stages": {"task_0": {}, "task_2": {}, "task_3": {"animation": false}}}
+
+    "stages" maps task names to their arguments (or is a plain list of task names).
+
+    Returns:
+        dict: name (or None), params, workers and stages.
+    """
+    with open(filename) as f:
+        config = json.load(f)
+    unknown = set(config) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown keys {sorted(unknown)} in {filename}, expected {list(CONFIG_KEYS)}.")
+    stages = config.get("stages", {})
+    if isinstance(stages, list):
+        stages = {name: {} for name in stages}
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}' in {filename}, expected one of {list(STAGES)}.")
+    return {"name": config.get("name"),
+            "params": {k: params.from_jsonable(v) for k, v in config.get("params", {}).items()},
+            "workers": config.get("workers", 1),
+            "stages": stages}
+
+def stage_key(name, kwargs):
+    """
+    Hash of everything a stage's outputs depend on: the physical parameters, the task
+    arguments and the output parameters of the stage (Stage.params, e.g. the decimation
+    of the stored line profile or the animation encoder).
+    """
+    output_params = {k: getattr(p, k) for k in STAGES[name].params}
+    return p.params_hash(extra={"stage": name, "kwargs": kwargs, "params": output_params})
+
+def _path(fname):
+    return os.path.join(p.path_to_save, fname)
+
+def _mtimes(files):
+    return {f: os.stat(_path(f)).st_mtime_ns if os.path.exists(_path(f)) else None for f in files}
+
+def load_state():
+    fname = _path(STATE_FILE)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+@master_only
+def _save_state(state):
+    os.makedirs(p.path_to_save, exist_ok=True)
+    tmp = _path(STATE_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, _path(STATE_FILE))
+
+def plan(stages, force=False):
+    """
+    Resolves the stages of a run into an ordered graph.
+
+    Stages reading a file that no planned stage writes get its producer added (with its
+    default arguments). A stage is out of date if it was never run with the same key
+    (stage_key()), an output is missing, an input changed since, or a stage it depends
+    on runs. Under MPI, run_pipeline() uses the decisions of the master rank on all ranks.
+
+    Args:
+        stages (dict): Task name -> task arguments (merged over the Stage defaults).
+        force (bool): Treat every stage as out of date.
+
+    Returns:
+        dict: Task name -> {"kwargs", "after" (stages it depends on), "key", "run" (bool)},
+              in execution order.
+    """
+    kwargs = {}
+    for name, given in stages.items():
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}', expected one of {list(STAGES)}.")
+        kwargs[name] = dict(STAGES[name].defaults, **(given or {}))
+
+    # producers of the inputs nobody in the plan writes
+    pending = list(kwargs)
+    while pending:
+        name = pending.pop(0)
+        for fname in STAGES[name].input_files(kwargs[name]):
+            if any(fname in STAGES[other].output_files(kwargs[other]) for other in kwargs):
+                continue
+            producer = next((other for other, stage in STAGES.items()
+                             if fname in stage.output_files(stage.defaults)), None)
+            if producer is None:
+                raise ValueError(f"No stage produces {fname}, needed by {name}.")
+            kwargs[producer] = dict(STAGES[producer].defaults)
+            pending.append(producer)
+
+    writers = {}
+    for name in kwargs:
+        for fname in STAGES[name].output_files(kwargs[name]):
+            if fname in writers:
+                raise ValueError(f"{fname} would be written by both {writers[fname]} and {name} - plan only one of them.")
+            writers[fname] = name
+    after = {name: sorted({writers[f] for f in STAGES[name].input_files(kwargs[name])}) for name in kwargs}
+
+    # topological order, otherwise in the order of STAGES
+    order = []
+    while len(order) < len(kwargs):
+        ready = [n for n in STAGES if n in kwargs and n not in order and all(d in order for d in after[n])]
+        if not ready:
+            raise ValueError(f"Cyclic stage dependencies: {after}")
+        order.append(ready[0])
+
+    state = load_state()
+    graph = {}
+    for name in order:
+        stage, key = STAGES[name], stage_key(name, kwargs[name])
+        stamp = state.get(name)
+        run = (force or stamp is None or stamp["key"] != key
+               or any(graph[d]["run"] for d in after[name])
+               or not all(os.path.exists(_path(f)) for f in stage.output_files(kwargs[name]))
+               or stamp["inputs"] != _mtimes(stage.input_files(kwargs[name])))
+        graph[name] = {"kwargs": kwargs[name], "after": after[name], "key": key, "run": run}
+    return graph
+
+def _run_stage(name, kwargs):
+    from . import taskManager # MEEP and matplotlib are imported only here
+
+    print_task(name[len("task_"):], STAGES[name].description)
+    # stages share the parameter singleton (also in a reused worker): start from the
+    # defaults plus the overrides of the run, not from what the previous stage left
+    p.reset_to_defaults()
+    getattr(taskManager, name)(**kwargs)
+
+def _run_stage_in_worker(name, kwargs, overrides, path_to_save, animations_folder_path):
+    """
+    Runs a stage inside a worker process, with the parameters of the parent.
+    """
+    p.apply_overrides(dict(overrides, headless=True)) # workers never show figures
+    p.path_to_save = path_to_save
+    p.animations_folder_path = animations_folder_path
+    _run_stage(name, kwargs)
+
+def run_pipeline(stages, workers=1, force=False):
+    """
+    Runs the out-of-date stages of plan(). With workers > 1 stages that do not depend on
+    each other run concurrently in spawned worker processes; under MPI the stages always
+    run one after the other. Every stage starts from p.reset_to_defaults(), i.e. the
+    defaults plus p.apply_overrides() and the result paths - parameters set directly on p
+    are not used.
+
+    Args:
+        stages (dict): Task name -> task arguments, e.g. {"task_0": {}, "task_2": {"plot": True}}.
+        workers (int): Number of stages run at the same time.
+        force (bool): Run every stage, even if it is up to date.
+
+    Returns:
+        dict: Task name -> "done" or "up to date".
+    """
+    graph = plan(stages, force=force)
+    for entry in graph.values():
+        entry["run"] = broadcast_flag(entry["run"]) # the files master sees decide for all ranks
+    state = load_state()
+    status = {}
+    for name, entry in graph.items():
+        if not entry["run"]:
+            print(f"Pipeline: {name} is up to date, skipped.")
+            status[name] = "up to date"
+    todo = [name for name, entry in graph.items() if entry["run"]]
+
+    def _finished(name):
+        entry = graph[name]
+        state[name] = {"key": entry["key"], "kwargs": params.to_jsonable(entry["kwargs"]),
+                       "inputs": _mtimes(STAGES[name].input_files(entry["kwargs"])),
+                       "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        _save_state(state)
+        status[name] = "done"
+
+    if workers <= 1 or count_ranks() > 1 or len(todo) <= 1:
+        for name in todo:
+            _run_stage(name, graph[name]["kwargs"])
+            _finished(name)
+        return status
+
+    # spawn: every worker starts with a fresh MEEP and fresh parameter singleton
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+        running = {}
+        while todo or running:
+            for name in [n for n in todo if all(d in status for d in graph[n]["after"])]:
+                todo.remove(name)
+                future = pool.submit(_run_stage_in_worker, name, graph[name]["kwargs"],
+                                     dict(getattr(p, "_overrides", {})),
+                                     p.path_to_save, p.animations_folder_path)
+                running[future] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                future.result()
+                _finished(name)
+    return status
@@ -0,0 +1,120 @@
+## Resolution convergence study of the gap enhancement
+import os
+import csv
+import json
+import time
+import numpy as np
+
+from . import params
+from utils.meep_utils import gap_center_value
+from utils.mpi_utils import makedirs, master_only
+
+# inicialize singleton of all parameters
+p = params.SimParams()
+
+def richardson_extrapolate(resolutions, values, order=None):
+    """
+    Fits values(h) = g0 + C * h**q with h = 1/resolution and returns (g0, q).
+
+    With three or more resolutions the order q is fitted (searched in [0.5, 4]);
+    with two, q defaults to 1 (staircased metal interfaces converge about linearly)
+    unless `order` is given.
+    """
+    h = 1.0 / np.asarray(resolutions, dtype=float)
+    g = np.asarray(values, dtype=float)
+
+    def fit(q):
+        A = np.stack([np.ones_like(h), h**q], axis=1)
+        coef, *_ = np.linalg.lstsq(A, g, rcond=None)
+        return coef[0], np.sum((A @ coef - g)**2)
+
+    if order is None and len(h) >= 3:
+        orders = np.linspace(0.5, 4.0, 351)
+        order = orders[int(np.argmin([fit(q)[1] for q in orders]))]
+    elif order is None:
+        order = 1.0
+    return float(fit(order)[0]), float(order)
+
+def gap_gain(E_max_with, E_max_without):
+    """
+    Linear gain at the gap centre from the task_4 fields with and without antennas.
+    """
+    return float(gap_center_value(E_max_with) / gap_center_value(E_max_without))
+
+@master_only
+def _write_report(root, report):
+    with open(os.path.join(root, "resolution_study.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(root, "resolution_study.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["resolution", "gap_gain", "rel_error", "runtime_s"])
+        for row in report["runs"]:
+            writer.writerow([row["resolution"], row["gap_gain"], row["rel_error"], row["runtime_s"]])
+
+def run_resolution_study(resolutions=(25, 35, 50, 70, 100), tol=0.02, mode="dft",
+                         skip_fraction=0.15, root=None, order=None, use_cache=False):
+    """
+    Runs the task_4 enhancement workflow at increasing resolutions, extrapolates the
+    gap gain to infinite resolution and reports the cheapest resolution whose gap gain
+    is within `tol` (relative) of the extrapolated value, with the runtime of each run.
+
+    Args:
+        resolutions (iterable of int): Resolutions to run (sorted ascending).
+        tol (float): Accepted relative error of the gap gain.
+        mode (str): task_4 enhancement mode ("dft" is cheapest).
+        root (str): Output directory (default <path_to_save>/resolution_study).
+        order (float): Convergence order for the extrapolation; fitted if None.
+        use_cache (bool): Reuse cached fields (p.use_cache). Off by default, so that the
+                          reported runtimes are simulation times, not cache loads.
+
+    Returns:
+        dict: The report, also written to resolution_study.json / .csv.
+    """
+    from . import taskManager
+
+    root = root or os.path.join(p.path_to_save, "resolution_study")
+    path_to_save, animations_folder_path = p.path_to_save, p.animations_folder_path
+    overrides = dict(getattr(p, "_overrides", {}))
+
+    runs = []
+    for res in sorted(resolutions):
+        p.apply_overrides({"resolution": res, "use_cache": use_cache})
+        p.path_to_save = os.path.join(root, f"res_{res}")
+        p.animations_folder_path = os.path.join(p.path_to_save, "animations")
+        makedirs(p.animations_folder_path)
+
+        t0 = time.time()
+        _, E_max_with, E_max_without = taskManager.task_4(skip_fraction=skip_fraction, mode=mode, return_fields=True)
+        runtime = time.time() - t0
+        runs.append({"resolution": res, "gap_gain": gap_gain(E_max_with, E_max_without), "runtime_s": runtime})
+        print(f"Resolution study: res={res} gap gain={runs[-1]['gap_gain']:.4g} ({runtime:.1f} s)")
+
+    # restore the parameters of the session
+    p._overrides = overrides
+    p.reset_to_defaults()
+    p.path_to_save, p.animations_folder_path = path_to_save, animations_folder_path
+
+    g0, q = richardson_extrapolate([r["resolution"] for r in runs], [r["gap_gain"] for r in runs], order=order)
+    for r in runs:
+        r["rel_error"] = abs(r["gap_gain"] - g0) / abs(g0)
+    # cheapest resolution from which on all finer ones stay within tol
+    adequate = []
+    for r in reversed(runs):
+        if r["rel_error"] >= tol:
+            break
+        adequate.insert(0, r["resolution"])
+
+    report = {"mode": mode,
+              "tol": tol,
+              "extrapolated_gap_gain": g0,
+              "convergence_order": q,
+              "recommended_resolution": adequate[0] if adequate else None,
+              "cached": use_cache,
+              "runs": runs}
+    if not adequate:
+        print(f"Resolution study: no resolution within tol={tol} - extend the resolution range.")
+    else:
+        print(f"Resolution study: cheapest adequate resolution = {adequate[0]}")
+    makedirs(root)
+    _write_report(root, report)
+    return report
@@ -1,50 +1,312 @@
 import meep as mp
+import numpy as np
+import os
 
 from . import params
 from . import containters
 from . import geometry
 from . import sources
+from . import cache
+from utils.mpi_utils import am_master, broadcast_flag, count_ranks, timed_run
+from utils.convergence import make_stop_condition
+from utils.checkpoint import Checkpointer
+from utils import telemetry
 
 # inicialize singleton of all parameters
 p = params.SimParams()
 con = containters.SimContainers()
 
+# direction of each field component; E is a vector, H a pseudovector
+_COMPONENT_AXIS = {mp.Ex: (0, "E"), mp.Ey: (1, "E"), mp.Ez: (2, "E"),
+                   mp.Hx: (0, "H"), mp.Hy: (1, "H"), mp.Hz: (2, "H")}
+_MIRROR_DIRECTION = {0: mp.X, 1: mp.Y, 2: mp.Z}
+_TOL = 1e-9
+
+# rough single-rank MEEP throughput (grid points updated per second) used for the runtime
+# estimate - calibrate it with the timesteps_per_s of a scaling report
+GRID_UPDATES_PER_S = 2e7
+_estimated = set()
+
+def _in_cell(obj, cell):
+    # objects entirely outside the cell (e.g. the bars moved to -9999 or z=-10) do not matter
+    for i in range(3):
+        c, s, L = obj.center[i], obj.size[i], cell[i]
+        if L == 0:
+            if abs(c) > s/2 + _TOL: # 2D: object must cross the z=0 plane
+                return False
+        elif abs(c) - s/2 >= L/2:
+            return False
+    return True
+
+def _geometry_mirror_symmetric(objects, axis):
+    for obj in objects:
+        if not isinstance(obj, mp.Block):
+            return False
+        mirrored = mp.Vector3(*[-obj.center[i] if i == axis else obj.center[i] for i in range(3)])
+        if not any(other.material is obj.material
+                   and (other.size == obj.size or (other.size - obj.size).norm() < _TOL) # mp.inf sizes
+                   and (other.center - mirrored).norm() < _TOL
+                   for other in objects if isinstance(other, mp.Block)):
+            return False
+    return True
+
+def _sources_mirror_symmetric(src_list, axis):
+    return all(src.amp_func is None and abs(src.center[axis]) < _TOL for src in src_list)
+
+def make_symmetries(geometry_objs, src_list):
+    """
+    Returns the mp.Mirror symmetries (with phases) permitted by the geometry, the sources
+    and the source component, or [] if p.use_symmetry is False. A mirror plane is used only
+    if both the geometry inside the cell and every source are symmetric with respect to it;
+    otherwise the simulation falls back to the full cell for that direction.
+
+    The phase is -1 if the source component is odd under the mirror: an E component normal
+    to the plane, or an H component parallel to it (H is a pseudovector).
+    """
+    if not p.use_symmetry:
+        return []
+
+    components = {src.component for src in src_list}
+    if len(components) != 1 or next(iter(components)) not in _COMPONENT_AXIS:
+        return []
+    comp_axis, kind = _COMPONENT_AXIS[next(iter(components))]
+
+    cell = geometry.make_cell()
+    objects = [obj for obj in geometry_objs if _in_cell(obj, cell)]
+
+    symmetries = []
+    for axis, direction in _MIRROR_DIRECTION.items():
+        if axis >= p.dimensions:
+            continue
+        if not _geometry_mirror_symmetric(objects, axis):
+            continue
+        if not _sources_mirror_symmetric(src_list, axis):
+            print(f"Symmetry: source breaks the mirror symmetry in {'xyz'[axis]}, using the full cell.")
+            continue
+        odd = (comp_axis == axis) if kind == "E" else (comp_axis != axis)
+        symmetries.append(mp.Mirror(direction, phase=-1 if odd else 1))
+    return symmetries
+
+def _grid_points(size):
+    return int(np.prod([max(1, int(round(size[i] * p.resolution))) for i in range(3)]))
+
+def _n_susceptibilities(medium):
+    return len(getattr(medium, "E_susceptibilities", None) or []) if medium is not None else 0
+
+def estimate_resources(until=None):
+    """
+    Up-front estimate of the memory and runtime of one simulation with the current parameters
+    (without symmetries, so an upper bound). The memory counts E, D, H, B, the inverse
+    epsilon/mu tensors and two time levels of every polarisation of the dispersive media.
+
+    Args:
+        until (float): Simulated time (default: max_sim_time with adaptive stopping,
+                       otherwise the longer of sim_time and animations_until).
+
+    Returns:
+        dict: grid_points, memory_gb, timesteps, runtime_s and output_frame_mb
+              (size of one collected frame of the output volume).
+    """
+    if until is None:
+        until = p.max_sim_time if p.adaptive_stop else max(p.sim_time, p.animations_until)
+    n_points = _grid_points(p.xyz_cell)
+    n_susc = max(_n_susceptibilities(p.material), _n_susceptibilities(p.substrate))
+    bytes_per_point = 8 * (4*3 + 2*6 + 2*3*n_susc)
+    timesteps = int(np.ceil(until * p.resolution / p.Courant_factor))
+    _, out_size = p.output_volume()
+    return {"grid_points": n_points,
+            "memory_gb": n_points * bytes_per_point / 1e9,
+            "timesteps": timesteps,
+            "runtime_s": n_points * timesteps / (GRID_UPDATES_PER_S * count_ranks()),
+            "output_frame_mb": _grid_points(out_size) * 8 / 1e6}
+
+def check_resources():
+    """
+    Prints the estimate of estimate_resources() once per geometry and raises MemoryError
+    if it exceeds p.max_memory_gb.
+    """
+    est = estimate_resources()
+    key = cache.structure_key()
+    if key not in _estimated and am_master():
+        print(f"Estimate ({p.dimensions}D): {est['grid_points']:.3g} grid points, {est['memory_gb']:.3g} GB, "
+              f"{est['timesteps']} time steps, ~{est['runtime_s']:.3g} s on {count_ranks()} rank(s), "
+              f"{est['output_frame_mb']:.3g} MB per output frame")
+    _estimated.add(key)
+    if p.max_memory_gb is not None and est["memory_gb"] > p.max_memory_gb:
+        raise MemoryError(f"Simulation needs ~{est['memory_gb']:.3g} GB > max_memory_gb={p.max_memory_gb} - "
+                          f"lower the resolution or the padding.")
+    return est
+
+@telemetry.stage("geometry_init")
 def make_sim():
+    check_resources()
+    geometry_objs = geometry.make_medium()
+    src_list = sources.make_source()
+    symmetries = make_symmetries(geometry_objs, src_list)
+
+    # the voxelised structure does not depend on the sources - reuse a cached one if possible.
+    # load_structure needs the chunk split of dump_structure, which follows the number of ranks
+    structure_file = None
+    if p.use_cache:
+        key = cache.structure_key(symmetries=[(s.direction, s.phase) for s in symmetries],
+                                  ranks=count_ranks())
+        structure_file = cache.cache_path("structure", key, ext="h5")
+    # decided on master: a rank loading the structure while another one voxelises would hang
+    has_structure = structure_file is not None and broadcast_flag(os.path.exists(structure_file))
+
     sim = mp.Simulation(
         cell_size = geometry.make_cell(),
         boundary_layers = [mp.PML(p.pml)],
-        geometry = geometry.make_medium(),
-        sources = sources.make_source(),
+        geometry = geometry_objs,
+        sources = src_list,
         resolution = p.resolution,
-        k_point = mp.Vector3()
+        k_point = mp.Vector3(),
+        symmetries = symmetries,
+        load_structure = structure_file if has_structure else ''
     )
+
+    if structure_file is not None and not has_structure:
+        # written once the structure exists (first timed_run), callers that only plot do not pay for it
+        sim.init_hooks = [lambda sim: _dump_structure(sim, structure_file)]
     return sim
 
+def _dump_structure(sim, structure_file):
+    if am_master():
+        os.makedirs(p.cache_dir, exist_ok=True)
+    # write under a temporary name so concurrent sweep workers never load a partial file
+    tmp_file = f"{structure_file[:-3]}.{os.getpid() if count_ranks() == 1 else 'mpi'}.tmp.h5"
+    sim.dump_structure(tmp_file)
+    if am_master():
+        os.replace(tmp_file, structure_file)
+    # later re-initialisations (after reset_meep) load the structure instead of re-voxelising
+    sim.load_structure_file = structure_file
+
+def get_epsilon_cached(sim):
+    """
+    Epsilon at p.freq on the output volume (p.output_volume()), cached per geometry hash,
+    frequency and output volume.
+    """
+    center, size = p.output_volume()
+    key = cache.structure_key(freq=p.freq, output_center=center, output_size=size)
+    cached = cache.load("epsilon", key)
+    if cached is not None:
+        return cached["eps"]
+    eps_data = sim.get_array(component=mp.Dielectric, center=center, size=size, frequency=p.freq)
+    cache.save("epsilon", key, eps=eps_data)
+    return eps_data
+
+def get_output_array(sim, component=None):
+    """
+    The field component (default p.component) on the output volume (p.output_volume()).
+    """
+    center, size = p.output_volume()
+    return sim.get_array(center=center, size=size, component=p.component if component is None else component)
+
 def start_calc(sim):
     sim.reset_meep()
     if not isinstance(sim, mp.Simulation):
         raise TypeError(f"Expected sim to be mp.Simulation, got {type(sim)} instead.")
-    sim.run(until=p.sim_time)
+    until = make_stop_condition(p, p.sim_time, label="start_calc")
+    checkpoint = Checkpointer.for_run(p, "start_calc")
+    if checkpoint is not None:
+        checkpoint.run(sim, until, label="start_calc")
+    else:
+        timed_run(sim, "start_calc", until=until)
 
-    eps_data = sim.get_epsilon(frequency=p.freq)
+    eps_data = get_epsilon_cached(sim)
     con.eps_data_container = eps_data
 
-    E_data = sim.get_array(center=mp.Vector3(), size=p.xyz_cell, component=p.component)
+    E_data = get_output_array(sim)
     con.E_comp_data_container = E_data
 
+def extend_calc(sim, extra_time):
+    """
+    Continues the checkpointed start_calc run by extra_time (instead of restarting from t=0)
+    and refreshes the field containers. Needs p.checkpoint_interval.
+    """
+    checkpoint = Checkpointer.for_run(p, "start_calc")
+    if checkpoint is None or not checkpoint.exists():
+        raise RuntimeError("No start_calc checkpoint to extend - set p.checkpoint_interval and run start_calc first.")
+    checkpoint.extend(sim, extra_time, label="start_calc")
+
+    con.eps_data_container = get_epsilon_cached(sim)
+    con.E_comp_data_container = get_output_array(sim)
+
+def branch_sim(label="start_calc"):
+    """
+    Returns a new simulation loaded with the warmed-up state of the checkpointed run `label`.
+    Several post-processing runs can branch off the same steady state this way.
+    """
+    checkpoint = Checkpointer.for_run(p, label)
+    if checkpoint is None or not checkpoint.exists():
+        raise RuntimeError(f"No '{label}' checkpoint to branch from - set p.checkpoint_interval.")
+    sim = make_sim()
+    checkpoint.branch(sim)
+    return sim
+
 def start_empty_cell_calc():
+    # the empty cell does not depend on the antenna geometry - reuse a cached reference if possible
+    key = cache.reference_key(kind="final_field", sim_time=p.sim_time)
+    cached = cache.load("empty_cell_E", key)
+    if cached is not None:
+        con.empty_cell_E_comp_data_container = cached["E_data"]
+        return 0
+
     p.center = [mp.Vector3(-9999, -9999, -9999), # upper bar
                 mp.Vector3(-9999, -9999, -9999)] # lower bar
     
     sim = make_sim()
     
-    sim.run(until=p.sim_time)
+    timed_run(sim, "start_empty_cell_calc", until=make_stop_condition(p, p.sim_time, label="empty_cell"))
 
-    E_data = sim.get_array(center=mp.Vector3(), size=p.xyz_cell, component=p.component)
+    E_data = get_output_array(sim)
     con.empty_cell_E_comp_data_container = E_data
+    cache.save("empty_cell_E", key, E_data=E_data)
 
     p.center = [mp.Vector3(0, p.y_length/2.0 + p.gap_size/2.0, 0), # upper bar
                 mp.Vector3(0, (-1)*(p.y_length/2.0 + p.gap_size/2.0), 0)] # lower bar
     sim.reset_meep()
 
-    return 0
\ No newline at end of file
+    return 0
+
+def collect_dft_field(sim, skip_fraction=0.15):
+    """
+    Steady-state amplitude |E(p.freq)| of the component field on the output volume,
+    accumulated by a MEEP DFT monitor during stepping (no per-step Python callbacks).
+
+    The monitor is added after the first skip_fraction of p.animations_until,
+    so the turn-on transient does not enter the estimate. The DFT of a CW field grows
+    linearly with the accumulation window, so it is divided by the window length: with
+    adaptive stopping the runs with and without antennas stop at different times, and
+    their ratio must not depend on that.
+    """
+    skip_time = p.animations_until * skip_fraction
+    sim.reset_meep()
+    if skip_time > 0:
+        timed_run(sim, "collect_dft_field", until=skip_time)
+    center, size = p.output_volume()
+    dft = sim.add_dft_fields([p.component], p.freq, 0, 1, center=center, size=size)
+    t_start = sim.meep_time()
+    timed_run(sim, "collect_dft_field", until=make_stop_condition(p, p.animations_until - skip_time, label="dft_field"))
+    window = sim.meep_time() - t_start
+    return np.abs(sim.get_dft_array(dft, p.component, 0)) / window
+
+def collect_dft_spectrum(sim, nfreq=None):
+    """
+    Broadband DFT of the component field on the output volume at nfreq frequencies
+    spanning p.freq +/- p.freq_width/2. Meant for a pulsed (source_type="gaussian") run:
+    the simulation stops once the fields at the cell centre have decayed by p.spectral_decay_tol.
+
+    Returns:
+        freqs (np.ndarray): The DFT frequencies.
+        E_spectrum (np.ndarray): (nfreq, nx, ny) array of |E(f)|.
+    """
+    nfreq = p.spectral_nfreq if nfreq is None else nfreq
+    sim.reset_meep()
+    center, size = p.output_volume()
+    dft = sim.add_dft_fields([p.component], p.freq, p.freq_width, nfreq, center=center, size=size)
+    timed_run(sim, "collect_dft_spectrum", until_after_sources=mp.stop_when_fields_decayed(50, p.component, mp.Vector3(), p.spectral_decay_tol))
+
+    freqs = np.linspace(p.freq - p.freq_width/2, p.freq + p.freq_width/2, nfreq) if nfreq > 1 else np.array([p.freq])
+    E_spectrum = np.array([np.abs(sim.get_dft_array(dft, p.component, i)) for i in range(nfreq)])
+    return freqs, E_spectrum
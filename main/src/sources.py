@@ -11,13 +11,34 @@ def pw_amp(k, x0):
         return cmath.exp(1j * 2 * math.pi * k.dot(x + x0))
     return _pw_amp
 
+def make_time_profile():
+    """
+    Time profile of the source: a continuous wave at p.freq, or (source_type="gaussian")
+    a pulse centred at p.freq with width p.freq_width for broadband spectral runs.
+    """
+    if p.source_type == "gaussian":
+        return mp.GaussianSource(p.freq, fwidth=p.freq_width, is_integrated=True)
+    if p.source_type == "continuous":
+        return mp.ContinuousSource(frequency=p.freq, is_integrated=True)
+    raise ValueError(f"Unknown source_type '{p.source_type}', expected 'continuous' or 'gaussian'.")
+
+def make_source_size():
+    """
+    Size of the source; in 3D a source without z extent is stretched over the cell height,
+    so the line source of the 2D setup becomes the corresponding plane.
+    """
+    size_z = p.src_size[2]
+    if p.dimensions == 3 and size_z == 0:
+        size_z = p.xyz_cell[2]
+    return mp.Vector3(p.src_size[0], p.src_size[1], size_z)
+
 def make_source():
     sources = [
         mp.Source(
-            src=mp.ContinuousSource(frequency=p.freq, is_integrated=True),
+            src=make_time_profile(),
             component=p.component,
             center=mp.Vector3(p.xyz_src[0], p.xyz_src[1], p.xyz_src[2]),
-            size = mp.Vector3(p.src_size[0], p.src_size[1], p.src_size[2]),
+            size = make_source_size(),
             amplitude=1.0
         )
     ]
@@ -0,0 +1,204 @@
+## Parallel parameter sweeps over SimParams fields
+import os
+import csv
+import json
+import time
+import itertools
+import traceback
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import params
+
+# inicialize singleton of all parameters
+p = params.SimParams()
+
+RESULT_FILE = "sweep_result.json"
+TABLE_FILE = "sweep_results.csv"
+
+def make_grid(**axes):
+    """
+    Builds the cartesian product of parameter values.
+
+    Example:
+        >>> make_grid(gap_size=[0.02, 0.05], x_width=[0.5, 0.7])
+        [{'gap_size': 0.02, 'x_width': 0.5}, {'gap_size': 0.02, 'x_width': 0.7}, ...]
+
+    Returns:
+        list of dict: One dict of parameter overrides per run.
+    """
+    keys = list(axes.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[axes[k] for k in keys])]
+
+def run_id(overrides):
+    """
+    Returns a filesystem-friendly, deterministic name of a run, e.g. "gap_size=0.05_x_width=0.7".
+    """
+    if not overrides:
+        return "defaults"
+    return "_".join(f"{k}={overrides[k]}" for k in sorted(overrides))
+
+def summarize(task_name, result):
+    """
+    Reduces the return value of a task to a few scalar numbers for the result table.
+    """
+    from utils.meep_utils import gap_center_value
+    from . import containters
+    con = containters.SimContainers()
+
+    if task_name == "task_4" and result is not None:
+        return {"gain_db_gap": float(gap_center_value(result)),
+                "gain_db_max": float(np.nanmax(result))}
+    if task_name == "task_0":
+        E = np.abs(con.E_comp_data_container)
+        return {"E_gap": float(gap_center_value(E)),
+                "E_max": float(np.max(E))}
+    return {}
+
+def common_cell(overrides_list):
+    """
+    Smallest cell enclosing the bars (plus pad) of every run - with it fixed as p.cell_size
+    the empty-cell reference is the same for the whole sweep and computed only once.
+    """
+    geometry = ("x_width", "y_length", "gap_size", "z_height", "pad", "pad_z", "dimensions")
+    cells = [params.natural_cell(**{k: overrides.get(k, getattr(p, k)) for k in geometry})
+             for overrides in overrides_list]
+    return [max(c[i] for c in cells) for i in range(3)]
+
+def _init_worker():
+    # workers never show figures
+    from visualization.plotter import set_headless
+    set_headless()
+
+def _apply_run_params(overrides, cell_size=None):
+    """
+    Sets p to the defaults plus the overrides of one run. Pool workers are reused, so the
+    overrides of the previous run (kept in p._overrides) are dropped first.
+    """
+    # workers never show figures (the tasks apply p.headless)
+    run_overrides = dict(overrides, headless=True)
+    if cell_size is not None:
+        run_overrides["cell_size"] = cell_size
+    p._overrides = {}
+    p.reset_to_defaults()
+    p.apply_overrides(run_overrides)
+
+def _run_single(task_name, overrides, root, task_kwargs, cell_size=None):
+    """
+    Runs a single task with the given parameter overrides in its own output directory.
+    Executed inside a worker process.
+    """
+    from . import taskManager
+
+    path = os.path.join(root, run_id(overrides))
+    _apply_run_params(overrides, cell_size)
+    p.path_to_save = path
+    p.animations_folder_path = os.path.join(path, "animations")
+    os.makedirs(p.animations_folder_path, exist_ok=True)
+    p.saveParams(filename=os.path.join(path, "simulation_params.txt"))
+
+    record = {"run_id": run_id(overrides), "overrides": overrides, "task": task_name,
+              "task_kwargs": task_kwargs, "cell_size": cell_size}
+    t0 = time.time()
+    try:
+        result = getattr(taskManager, task_name)(**task_kwargs)
+        record.update(status="done", summary=summarize(task_name, result))
+    except Exception:
+        record.update(status="failed", error=traceback.format_exc(), summary={})
+    record["runtime_s"] = time.time() - t0
+
+    if record["status"] == "done":
+        with open(os.path.join(path, RESULT_FILE), "w") as f:
+            json.dump(record, f, indent=2)
+    return record
+
+def _load_record(root, overrides, task_name, task_kwargs, cell_size=None):
+    """
+    The record of a finished run, or None if there is none or it was made by another
+    task, with other task arguments or in another cell.
+    """
+    fname = os.path.join(root, run_id(overrides), RESULT_FILE)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        record = json.load(f)
+    # compared as stored, i.e. after a JSON round trip (tuples become lists)
+    expected = json.loads(json.dumps({"task": task_name, "task_kwargs": task_kwargs, "cell_size": cell_size}))
+    if any(record.get(k) != v for k, v in expected.items()):
+        return None
+    return record
+
+def write_table(records, filename):
+    """
+    Writes the consolidated result table (one row per run) as CSV.
+    """
+    param_keys = sorted({k for r in records for k in r["overrides"]})
+    summary_keys = sorted({k for r in records for k in r.get("summary", {})})
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["run_id"] + param_keys + summary_keys + ["runtime_s", "status"])
+        for r in records:
+            writer.writerow([r["run_id"]]
+                            + [r["overrides"].get(k, "") for k in param_keys]
+                            + [r.get("summary", {}).get(k, "") for k in summary_keys]
+                            + [r.get("runtime_s", ""), r["status"]])
+
+def run_sweep(overrides_list, task="task_4", root="results/sweep", max_workers=None,
+              task_kwargs=None, resume=True, fixed_cell=True):
+    """
+    Runs `task` for every set of parameter overrides concurrently on local cores.
+
+    Each run gets its own output directory root/<run_id>. Finished runs leave a
+    sweep_result.json marker there; with resume=True they are not recomputed, unless
+    the marker was written for another task, other task_kwargs or another common cell.
+    A consolidated table is written to root/sweep_results.csv.
+
+    Args:
+        overrides_list (list of dict): Parameter overrides, e.g. from make_grid().
+        task (str): Name of the task function in taskManager ("task_0", "task_4", ...).
+        root (str): Directory collecting the runs of this sweep.
+        max_workers (int): Number of worker processes (default: all cores).
+        task_kwargs (dict): Keyword arguments passed to the task.
+        resume (bool): Skip runs that already have a matching result marker.
+        fixed_cell (bool): Simulate every run in the same cell (common_cell()), so the
+                           empty-cell reference is shared instead of recomputed per geometry.
+                           The first run then goes alone and computes it (with p.use_cache).
+
+    Returns:
+        list of dict: One record per run, in the order of overrides_list.
+    """
+    task_kwargs = task_kwargs or {}
+    os.makedirs(root, exist_ok=True)
+    cell_size = common_cell(overrides_list) if fixed_cell and p.cell_size is None else None
+
+    records = [None] * len(overrides_list)
+    pending = []
+    for idx, overrides in enumerate(overrides_list):
+        record = _load_record(root, overrides, task, task_kwargs, cell_size) if resume else None
+        if record is not None:
+            print(f"Sweep: skipping finished run {record['run_id']}")
+            records[idx] = record
+        else:
+            pending.append(idx)
+
+    # in a common cell the first run computes (and caches) the empty-cell reference of all
+    # runs; started together, every worker would miss the cache and compute it again
+    shared_reference = p.use_cache and (cell_size is not None or p.cell_size is not None)
+    batches = [pending[:1], pending[1:]] if shared_reference else [pending]
+
+    if pending:
+        # spawn: every worker starts with a fresh MEEP and fresh parameter singleton
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx, initializer=_init_worker) as pool:
+            for batch in batches:
+                futures = {pool.submit(_run_single, task, overrides_list[idx], root, task_kwargs, cell_size): idx
+                           for idx in batch}
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    records[idx] = future.result()
+                    print(f"Sweep: {records[idx]['run_id']} -> {records[idx]['status']} "
+                          f"({records[idx]['runtime_s']:.1f} s)")
+
+    write_table(records, os.path.join(root, TABLE_FILE))
+    return records
@@ -1,41 +1,98 @@
 from . import params
 from . import containters
 from . import simulation
+from . import cache
 
 import meep as mp
 from visualization.plotter import *
 import numpy as np
+import json
 import os
+import functools
 
 from utils.meep_utils import *
+from utils.mpi_utils import am_master, makedirs, save_npz
+from utils.convergence import convergence_log, make_stop_condition
+from utils import postprocess
+from utils import telemetry
+from utils import async_io
 
 # inicialize singleton of all parameters
 p = params.SimParams()
 con = containters.SimContainers()
 
+def instrumented(task):
+    """
+    Decorator: records the telemetry of the task (wall time per stage, timesteps/s,
+    callback overhead, peak RSS) in <path_to_save>/telemetry_report.json.
+    Output written in the background (utils.async_io) is flushed before the task returns.
+    """
+    @functools.wraps(task)
+    def wrapper(*args, **kwargs):
+        async_io.configure(p.async_output, max_workers=p.output_workers, max_pending=p.output_queue_size)
+        set_headless(p.headless) # both ways - a previous task may have switched it on
+        convergence_log.clear() # the data files of a task only report the runs of that task
+        with telemetry.task(task.__name__):
+            try:
+                result = task(*args, **kwargs)
+            except BaseException:
+                # write what was queued, but never hide the error of the task behind an output error
+                try:
+                    async_io.flush()
+                except Exception as e:
+                    print(f"Warning: background output of {task.__name__} failed as well: {e!r}")
+                raise
+            async_io.flush()
+        telemetry.write_report(os.path.join(p.path_to_save, telemetry.REPORT_FILE))
+        return result
+    return wrapper
+
+def load_general_data():
+    """
+    Fills the data containers from <path_to_save>/data_general.npz (written by task_0 / task_5)
+    unless this process already holds them - the analysis tasks can run on their own.
+    """
+    if len(con.eps_data_container) > 0:
+        return
+    with np.load(os.path.join(p.path_to_save, "data_general.npz")) as data:
+        con.E_comp_data_container = data["Ey"]
+        con.empty_cell_E_comp_data_container = data["Ey_empty"]
+        con.eps_data_container = data["eps"]
+
 # TASK 0 -------------------------------
 # Triggering calculations and saving the most general results.
 
+@instrumented
 def task_0():
     
     p.showParams()
 
-    if not os.path.exists(p.path_to_save):
-        os.makedirs(p.path_to_save)
-    if not os.path.exists(p.animations_folder_path):
-        os.makedirs(p.animations_folder_path)
+    makedirs(p.path_to_save)
+    makedirs(p.animations_folder_path)
     
     p.saveParams(filename=os.path.join(p.path_to_save, "simulation_params.txt"))
 
-    simulation.start_empty_cell_calc() # MUST BE CALLED FIRST
+    # unchanged parameters -> load the antenna fields instead of recomputing them
+    key = cache.results_key(stage="task_0")
+    cached = cache.load("task_0_fields", key)
+
+    simulation.start_empty_cell_calc() # before make_sim(): it moves the bars away and back
     sim = simulation.make_sim()
-    simulation.start_calc(sim)
+    if cached is not None:
+        print("Task 0: parameters unchanged, loading cached fields.")
+        con.E_comp_data_container = cached["Ey"]
+        con.eps_data_container = cached["eps"]
+    else:
+        simulation.start_calc(sim)
+        cache.save("task_0_fields", key, Ey=con.E_comp_data_container, eps=con.eps_data_container)
 
-    np.savez(
+    save_npz(
         os.path.join(p.path_to_save, "data_general.npz"),
         Ey = con.E_comp_data_container,
         Ey_empty = con.empty_cell_E_comp_data_container,
-        eps = con.eps_data_container
+        eps = con.eps_data_container,
+        convergence = json.dumps(convergence_log),
+        params_hash = p.params_hash()
         )
     
     return sim
@@ -43,23 +100,25 @@ def task_0():
 # TASK 1 -------------------------------
 # Make medium - a split bar antenna.
 
+@instrumented
 def task_1():
     p.showParams()
     sim = simulation.make_sim()
-    sim.plot2D()
-    plt.savefig(os.path.join(p.path_to_save, "2Dplot.png"), dpi=300, bbox_inches="tight", format="png")
-    if p.IMG_CLOSE:
-        plt.show(block=False)
-        plt.pause(2)
-        plt.close("all")
-    else:
-        plt.show()
+    with telemetry.stage("plotting"):
+        if p.dimensions == 3: # cut through the output plane
+            center, size = p.output_volume()
+            sim.plot2D(output_plane=mp.Volume(center=center, size=size)) # collective - called on every rank
+        else:
+            sim.plot2D() # collective - called on every rank
+        if am_master():
+            finish_figure(os.path.join(p.path_to_save, "2Dplot.png"), p.IMG_CLOSE)
 
     return 0
 
 # TASK 2 -------------------------------
 # Plotting the dielectric constant of a system.
 
+@instrumented
 def task_2(plot=False, recalculate=False):
     
     p.showParams()
@@ -67,6 +126,8 @@ def task_2(plot=False, recalculate=False):
     if recalculate:    
         sim = simulation.make_sim()
         simulation.start_calc(sim)
+    else:
+        load_general_data()
       
     if plot:
         show_data_img(datas_arr =   [con.eps_data_container],
@@ -74,6 +135,7 @@ def task_2(plot=False, recalculate=False):
                       abs_bool  =   [True],
                       cmap_arr  =   ["binary"],
                       alphas    =   [1.0],
+                      name_to_save = os.path.join(p.path_to_save, "Epsilon"),
                       IMG_CLOSE =   p.IMG_CLOSE)
     
     return 0
@@ -81,17 +143,26 @@ def task_2(plot=False, recalculate=False):
 # TASK 3 -------------------------------
 # Calculations of the scalar electric field E component and optional plotting and animation.
 
+@instrumented
 def task_3(plot=False, animation=False, animation_name="animation",
            plot_3D=False, sim=None,
-           recalculate=False):
+           recalculate=False, store_frames=False, from_checkpoint=False):
     p.showParams()
     
     if recalculate:
         sim = simulation.make_sim()
         simulation.start_calc(sim)
+    if from_checkpoint:
+        # record from the warmed-up state of task_0 instead of from t=0
+        sim = simulation.branch_sim("start_calc")
+    if not recalculate:
+        load_general_data()
+    if sim is None:
+        sim = simulation.make_sim() # run_observers() starts it from t=0
     
+    figures = FigureQueue(p.render_processes)
     if plot:
-        show_data_img(datas_arr =   [con.eps_data_container, con.E_comp_data_container],
+        figures.add(show_data_img, datas_arr =   [con.eps_data_container, con.E_comp_data_container],
                       norm_bool =   [True, False],
                       abs_bool  =   [True, False],
                       cmap_arr  =   ["binary", "RdBu"],
@@ -100,7 +171,7 @@ def task_3(plot=False, animation=False, animation_name="animation",
                       IMG_CLOSE =   p.IMG_CLOSE)
         
     if plot:
-        show_data_img(datas_arr =   [con.empty_cell_E_comp_data_container],
+        figures.add(show_data_img, datas_arr =   [con.empty_cell_E_comp_data_container],
                       norm_bool =   [False],
                       abs_bool  =   [False],
                       cmap_arr  =   ["RdBu"],
@@ -108,29 +179,65 @@ def task_3(plot=False, animation=False, animation_name="animation",
                       name_to_save = os.path.join(p.path_to_save, "E_component_empty_cell"),
                       IMG_CLOSE =   p.IMG_CLOSE)
         
+    # animation and centre-line profile share a single time-stepping pass
+    line = LineProfileObserver(p, delta_t=p.animations_step, width=5,
+                               decimation=Decimation.from_params(p.history_decimation))
+    observers = [line]
     if animation:
-        make_animation(p, sim, animation_name)
-        
-    collected_data, time_steps, x_coords = collect_e_line(p, sim, delta_t=p.animations_step, width=5, plot_3d=plot_3D, name=animation_name)
-    np.savez(
+        # one colour range for the whole video: the task_0 field at the end of the run
+        vmax = float(np.max(np.abs(con.E_comp_data_container))) if len(con.E_comp_data_container) else None
+        observers.append(animation_observer(p, sim, animation_name, streaming=p.stream_animations, vmax=vmax))
+    if store_frames:
+        # full-cell history written incrementally to disk, readable lazily afterwards
+        observers.append(full_cell_monitor(p, delta_t=p.animations_step,
+                                           store=FrameStore(os.path.join(p.path_to_save, f"frames_E_{animation_name}"), mode="w"),
+                                           decimation=Decimation.from_params(p.history_decimation)))
+    run_observers(sim, observers, reset=not from_checkpoint)
+
+    collected_data, time_steps, x_coords = line.collected_data, line.time_steps, line.x_coords
+    if plot_3D and len(collected_data) > 0:
+        figures.add(plot_e_3d, collected_data, x_coords, time_steps,
+                  name=os.path.join(p.path_to_save, f"3Dplot_profile_{animation_name}.png"),
+                  IMG_CLOSE=p.IMG_CLOSE)
+    save_npz(
         os.path.join(p.path_to_save, f"data_E_line_{animation_name}.npz"),
         collected_data=collected_data,
         time_steps=time_steps,
-        x_coords=x_coords
+        x_coords=x_coords,
+        decimation=json.dumps(line.decimation.report() if line.decimation is not None else None)
         )
+    figures.render()
 
     return 0
            
 # TASK 4 -------------------------------
+# Field enhancement |E_with| / |E_without|. mode="time" takes the maximum of |E| sampled every
+# animations_step, mode="dft" the steady-state amplitude at p.freq from a DFT monitor.
+
+def _enhancement_field(sim, mode, skip_fraction, optional_name):
+    if mode == "dft":
+        return zero_frame_edges(simulation.collect_dft_field(sim, skip_fraction=skip_fraction), 20)
+    if mode == "time":
+        return collect_max_field(p, sim, delta_t=p.animations_step, skip_fraction=skip_fraction, optional_name=optional_name)
+    raise ValueError(f"Unknown enhancement mode '{mode}', expected 'time' or 'dft'.")
 
-def task_4(skip_fraction=0.15, E_plot=False):
+@instrumented
+def task_4(skip_fraction=0.15, E_plot=False, mode="time", return_fields=False):
     p.reset_to_defaults()
+    figures = FigureQueue(p.render_processes)
     
     # --- With antennas ---
-    sim = simulation.make_sim()
-    E_max_with = collect_max_field(p, sim, delta_t=p.animations_step, skip_fraction=skip_fraction, optional_name="with_antennas")
+    key = cache.results_key(stage="task_4", mode=mode, skip_fraction=skip_fraction)
+    cached = cache.load("enhancement_field", key)
+    if cached is not None:
+        print("Task 4: parameters unchanged, loading cached field with antennas.")
+        E_max_with = cached["E_max"]
+    else:
+        sim = simulation.make_sim()
+        E_max_with = _enhancement_field(sim, mode, skip_fraction, "with_antennas")
+        cache.save("enhancement_field", key, E_max=E_max_with)
     if E_plot:
-        show_data_img(datas_arr =   [E_max_with],
+        figures.add(show_data_img, datas_arr =   [E_max_with],
                         norm_bool =   [False],
                         abs_bool  =   [False],
                         cmap_arr  =   ["inferno"],
@@ -139,12 +246,24 @@ def task_4(skip_fraction=0.15, E_plot=False):
                         IMG_CLOSE =   p.IMG_CLOSE)
     
     # --- Without antennas ---
-    p.center = [mp.Vector3(0, 0, -10.), 
-                mp.Vector3(0, 0, -10.)]
-    sim = simulation.make_sim()
-    E_max_without = collect_max_field(p, sim, delta_t=p.animations_step, skip_fraction=skip_fraction, optional_name="without_antennas")
+    # the reference does not depend on the antenna geometry - reuse it from the cache if possible
+    ref_key = cache.reference_key(kind=f"{mode}_field", animations_until=p.animations_until,
+                                  delta_t=p.animations_step, skip_fraction=skip_fraction)
+    cached = cache.load("empty_cell_E_max", ref_key)
+    if cached is not None:
+        E_max_without = cached["E_max"]
+    else:
+        centers = p.center
+        p.center = [mp.Vector3(0, 0, -10.), 
+                    mp.Vector3(0, 0, -10.)]
+        try:
+            sim = simulation.make_sim()
+            E_max_without = _enhancement_field(sim, mode, skip_fraction, "without_antennas")
+        finally:
+            p.center = centers # later tasks must see the antennas again
+        cache.save("empty_cell_E_max", ref_key, E_max=E_max_without)
     if E_plot:
-        show_data_img(datas_arr =   [E_max_without],
+        figures.add(show_data_img, datas_arr =   [E_max_without],
                         norm_bool =   [False],
                         abs_bool  =   [False],
                         cmap_arr  =   ["inferno"],
@@ -153,13 +272,11 @@ def task_4(skip_fraction=0.15, E_plot=False):
                         IMG_CLOSE =   p.IMG_CLOSE)
     
     # --- Gain ---   
-    gain = E_max_with / E_max_without
+    gain = postprocess.gain_map(E_max_with, E_max_without)
 
     # --- Outliers clipping ---
-    vmin = np.nanpercentile(gain, 1)
-    vmax = np.nanpercentile(gain, 99)
-    gain_clipped = np.clip(gain, vmin, vmax)
-    show_data_img(datas_arr =   [gain_clipped],
+    gain_clipped, vmin, vmax = postprocess.percentile_clip(gain, 1, 99)
+    figures.add(show_data_img, datas_arr =   [gain_clipped],
                     norm_bool =   [False],
                     abs_bool  =   [False],
                     cmap_arr  =   ["inferno"],
@@ -168,9 +285,9 @@ def task_4(skip_fraction=0.15, E_plot=False):
                     IMG_CLOSE =   p.IMG_CLOSE)
     
     # --- Gain in dB ---
-    gain_db = 20.0 * np.log10(gain + 1e-12)
-    gain_db_clipped = np.clip(gain_db, vmin, vmax)
-    show_data_img(datas_arr =   [gain_db_clipped],
+    gain_db = postprocess.to_db(gain)
+    gain_db_clipped, _, _ = postprocess.percentile_clip(gain_db, 1, 99)
+    figures.add(show_data_img, datas_arr =   [gain_db_clipped],
                     norm_bool =   [False],
                     abs_bool  =   [False],
                     cmap_arr  =   ["inferno"],
@@ -178,12 +295,144 @@ def task_4(skip_fraction=0.15, E_plot=False):
                     name_to_save = os.path.join(p.path_to_save, "Gain_dB_scale"),
                     IMG_CLOSE =   p.IMG_CLOSE)
     
-    np.savez(
+    save_npz(
         os.path.join(p.path_to_save, "data_enhancement.npz"),
         E_max_with=np.array(E_max_with),
         E_max_without=np.array(E_max_without),
         gain_clipped=gain_clipped,
-        gain_db_clipped=gain_db_clipped
+        gain_db_clipped=gain_db_clipped,
+        mode=mode,
+        convergence=json.dumps(convergence_log),
+        params_hash=p.params_hash()
         )
+    figures.render()
 
-    return gain_db_clipped
\ No newline at end of file
+    if return_fields:
+        # unclipped fields, on every rank (data_enhancement.npz is written by master in the background)
+        return gain_db_clipped, E_max_with, E_max_without
+    return gain_db_clipped
+
+# TASK 5 -------------------------------
+# Single-pass analysis: one time-stepping run feeds the epsilon snapshot, the final field,
+# the centre-line profile, the running maximum and (optionally) the animation.
+
+@instrumented
+def task_5(animation=False, animation_name="with_antennas", plot_3D=False, skip_fraction=0.15):
+    p.showParams()
+
+    makedirs(p.path_to_save)
+    makedirs(p.animations_folder_path)
+
+    simulation.start_empty_cell_calc() # cached reference
+    sim = simulation.make_sim()
+
+    final = FinalFieldObserver(p, at_time=None if p.adaptive_stop else p.sim_time)
+    line = LineProfileObserver(p, delta_t=p.animations_step, width=5,
+                               decimation=Decimation.from_params(p.history_decimation))
+    max_field = MaxFieldObserver(p, delta_t=p.animations_step,
+                                 skip_time=p.animations_until * skip_fraction)
+    observers = [final, line, max_field]
+    if animation:
+        observers.append(animation_observer(p, sim, animation_name, streaming=p.stream_animations))
+    run_observers(sim, observers,
+                  until=make_stop_condition(p, max(p.sim_time, p.animations_until), label="task_5",
+                                            min_time=p.animations_until * skip_fraction),
+                  checkpoint=Checkpointer.for_run(p, "task_5"))
+
+    con.eps_data_container = simulation.get_epsilon_cached(sim)
+    con.E_comp_data_container = final.data
+    save_npz(
+        os.path.join(p.path_to_save, "data_general.npz"),
+        Ey = con.E_comp_data_container,
+        Ey_empty = con.empty_cell_E_comp_data_container,
+        eps = con.eps_data_container,
+        convergence = json.dumps(convergence_log)
+        )
+
+    if plot_3D and len(line.collected_data) > 0:
+        plot_e_3d(line.collected_data, line.x_coords, line.time_steps,
+                  name=os.path.join(p.path_to_save, f"3Dplot_profile_{animation_name}.png"),
+                  IMG_CLOSE=p.IMG_CLOSE)
+    save_npz(
+        os.path.join(p.path_to_save, f"data_E_line_{animation_name}.npz"),
+        collected_data=line.collected_data,
+        time_steps=line.time_steps,
+        x_coords=line.x_coords,
+        decimation=json.dumps(line.decimation.report() if line.decimation is not None else None)
+        )
+
+    E_max_with = max_field_results(p, max_field, optional_name=animation_name)
+    save_npz(
+        os.path.join(p.path_to_save, f"data_max_field_{animation_name}.npz"),
+        E_max=E_max_with
+        )
+
+    return sim
+
+# TASK 6 -------------------------------
+# Broadband enhancement spectrum from a single Gaussian-pulse run (per geometry)
+# instead of one continuous-wave task_4 run per wavelength.
+
+@instrumented
+def task_6(nfreq=None, E_plot=False):
+    p.reset_to_defaults()
+    p.source_type = "gaussian"
+    nfreq = p.spectral_nfreq if nfreq is None else nfreq
+
+    makedirs(p.path_to_save)
+
+    # --- With antennas ---
+    sim = simulation.make_sim()
+    freqs, E_with = simulation.collect_dft_spectrum(sim, nfreq=nfreq)
+
+    # --- Without antennas ---
+    ref_key = cache.reference_key(kind="dft_spectrum", nfreq=nfreq, decay_tol=p.spectral_decay_tol)
+    cached = cache.load("empty_cell_E_spectrum", ref_key)
+    if cached is not None:
+        E_without = cached["E_spectrum"]
+    else:
+        p.center = [mp.Vector3(0, 0, -10.), 
+                    mp.Vector3(0, 0, -10.)]
+        sim = simulation.make_sim()
+        _, E_without = simulation.collect_dft_spectrum(sim, nfreq=nfreq)
+        cache.save("empty_cell_E_spectrum", ref_key, E_spectrum=E_without)
+
+    # --- Gain spectrum ---
+    for E in (E_with, E_without):
+        for frame in E:
+            zero_frame_edges(frame, 20)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gain = E_with / E_without
+    gap_gain = np.array([gap_center_value(g) for g in gain])
+    wavelengths = 1.0 / freqs
+
+    save_npz(
+        os.path.join(p.path_to_save, "data_spectral_enhancement.npz"),
+        freqs=freqs,
+        wavelengths=wavelengths,
+        E_with=E_with,
+        E_without=E_without,
+        gain=gain,
+        gap_gain=gap_gain
+        )
+
+    if am_master():
+        with telemetry.stage("plotting"):
+            ax = line_plotter(wavelengths, 20.0 * np.log10(gap_gain + 1e-12),
+                              xlabel=r"$\lambda$ [$\mu$m]", ylabel=r"Gap gain [dB]")
+            finish_figure(os.path.join(p.path_to_save, "Gap_gain_spectrum.png"), p.IMG_CLOSE)
+
+    if E_plot:
+        peak = int(np.nanargmax(gap_gain))
+        vmin = np.nanpercentile(gain[peak], 1)
+        vmax = np.nanpercentile(gain[peak], 99)
+        show_data_img(datas_arr =   [np.clip(gain[peak], vmin, vmax)],
+                        norm_bool =   [False],
+                        abs_bool  =   [False],
+                        cmap_arr  =   ["inferno"],
+                        alphas    =   [1.0],
+                        name_to_save = os.path.join(p.path_to_save, f"Gain_linear_scale_peak_{wavelengths[peak]:.3f}um"),
+                        IMG_CLOSE =   p.IMG_CLOSE)
+
+    p.reset_to_defaults()
+    return wavelengths, gap_gain
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import async_io
+from utils.frame_store import FrameStore
+
+
+def _frames(n, start=0):
+    return [np.full((3, 2), i, dtype=float) for i in range(start, start + n)]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("background", [False, True])
+def test_append_flush_append_random_access(tmp_path, compress, background):
+    async_io.configure(background)
+    try:
+        store = FrameStore(str(tmp_path / "frames"), mode="w", chunk_frames=4, compress=compress)
+        for i, frame in enumerate(_frames(6)):
+            store.append(frame, t=i)
+        store.flush()
+        for i, frame in enumerate(_frames(4, start=6)):
+            store.append(frame, t=i + 6)
+        store.close()
+    finally:
+        async_io.configure(False)
+
+    frames = FrameStore(str(tmp_path / "frames"))
+    assert len(frames) == 10
+    assert len(frames.meta["chunks"]) == 3
+    np.testing.assert_array_equal(frames.times, np.arange(10))
+    for i in [6, 0, 9, 3, 4, 7]:
+        assert frames[i][0, 0] == i
+    np.testing.assert_array_equal(frames[[9, 2, 6, 5], 0, 0], [9, 2, 6, 5])
+    np.testing.assert_array_equal(frames[::3, 1, 1], [0, 3, 6, 9])
+    assert sum(len(block) for _, block in frames.iter_chunks()) == 10
+
+
+def test_reopen_partial_chunk_for_append(tmp_path):
+    path = str(tmp_path / "frames")
+    with FrameStore(path, mode="w", chunk_frames=4) as store:
+        for i, frame in enumerate(_frames(5)):
+            store.append(frame, t=i)
+
+    store = FrameStore(path, mode="a")
+    for i, frame in enumerate(_frames(5, start=5)):
+        store.append(frame, t=i + 5)
+        store.flush()
+    store.close()
+
+    frames = FrameStore(path)
+    assert len(frames) == 10
+    np.testing.assert_array_equal(frames[:, 0, 0], np.arange(10))
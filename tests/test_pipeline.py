@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "main")))
+
+from src import params, pipeline
+
+
+@pytest.fixture
+def p(tmp_path):
+    p = params.SimParams() # the singleton shared with pipeline
+    p._overrides = {}
+    p.reset_to_defaults()
+    p.path_to_save = str(tmp_path)
+    yield p
+    p._overrides = {}
+    p.reset_to_defaults()
+
+
+def _finish(p, graph, name):
+    """Pretends `name` ran: writes its outputs and records it like run_pipeline()."""
+    entry = graph[name]
+    for fname in pipeline.STAGES[name].output_files(entry["kwargs"]):
+        open(os.path.join(p.path_to_save, fname), "w").close()
+    state = pipeline.load_state()
+    state[name] = {"key": entry["key"],
+                   "inputs": pipeline._mtimes(pipeline.STAGES[name].input_files(entry["kwargs"]))}
+    pipeline._save_state(state)
+
+
+@pytest.mark.parametrize("name, value", [("history_decimation", {"time_stride": 4}),
+                                         ("stream_animations", True),
+                                         ("animations_fps", 25)])
+def test_output_params_change_the_stage_key(p, name, value):
+    kwargs = dict(pipeline.STAGES["task_3"].defaults)
+    task_3, task_0 = pipeline.stage_key("task_3", kwargs), pipeline.stage_key("task_0", {})
+    p.apply_overrides({name: value})
+    assert pipeline.stage_key("task_3", kwargs) != task_3
+    assert pipeline.stage_key("task_0", {}) == task_0
+
+
+def test_plan_adds_producers_in_order(p):
+    graph = pipeline.plan({"task_3": {}})
+    assert list(graph) == ["task_0", "task_3"]
+    assert graph["task_3"]["after"] == ["task_0"]
+    assert all(entry["run"] for entry in graph.values())
+
+
+def test_plan_skips_up_to_date_stages(p):
+    graph = pipeline.plan({"task_0": {}, "task_3": {}})
+    _finish(p, graph, "task_0")
+    _finish(p, graph, "task_3")
+    graph = pipeline.plan({"task_0": {}, "task_3": {}})
+    assert not graph["task_0"]["run"] and not graph["task_3"]["run"]
+
+    # other task arguments, an output parameter or a re-run producer -> out of date
+    assert pipeline.plan({"task_3": {"animation_name": "other"}})["task_3"]["run"]
+    p.apply_overrides({"history_decimation": {"time_stride": 2}})
+    graph = pipeline.plan({"task_0": {}, "task_3": {}})
+    assert not graph["task_0"]["run"] and graph["task_3"]["run"]
+    p.apply_overrides({"gap_size": p.gap_size * 2})
+    assert pipeline.plan({"task_3": {}})["task_0"]["run"]
+
+
+def test_plan_rejects_two_writers(p):
+    with pytest.raises(ValueError):
+        pipeline.plan({"task_0": {}, "task_5": {}})
@@ -0,0 +1,43 @@
+import os
+import json
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "main")))
+
+from src import params, sweep
+
+
+def test_run_overrides_do_not_leak_between_runs():
+    p = params.SimParams() # the singleton shared with sweep
+    p._overrides = {}
+    p.reset_to_defaults()
+    default_gap = p.gap_size
+    try:
+        sweep._apply_run_params({"gap_size": default_gap * 2})
+        assert p.gap_size == default_gap * 2
+
+        # the same (reused) worker process runs the next point of the sweep
+        sweep._apply_run_params({"x_width": 0.5})
+        assert p.x_width == 0.5
+        assert p.gap_size == default_gap
+        assert p._overrides == {"x_width": 0.5, "headless": True}
+    finally:
+        p._overrides = {}
+        p.reset_to_defaults()
+
+
+def test_resume_only_reuses_matching_records(tmp_path):
+    root = str(tmp_path)
+    overrides = {"gap_size": 0.02}
+    os.makedirs(os.path.join(root, sweep.run_id(overrides)))
+    record = {"run_id": sweep.run_id(overrides), "overrides": overrides, "task": "task_4",
+              "task_kwargs": {"mode": "dft"}, "cell_size": [1.5, 2.0, 0], "status": "done"}
+    with open(os.path.join(root, sweep.run_id(overrides), sweep.RESULT_FILE), "w") as f:
+        json.dump(record, f)
+
+    assert sweep._load_record(root, overrides, "task_4", {"mode": "dft"}, (1.5, 2.0, 0)) == record
+    assert sweep._load_record(root, overrides, "task_0", {"mode": "dft"}, [1.5, 2.0, 0]) is None
+    assert sweep._load_record(root, overrides, "task_4", {"mode": "time"}, [1.5, 2.0, 0]) is None
+    assert sweep._load_record(root, overrides, "task_4", {"mode": "dft"}, None) is None
+    assert sweep._load_record(root, {"gap_size": 0.05}, "task_4", {"mode": "dft"}, None) is None
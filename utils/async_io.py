@@ -0,0 +1,104 @@
+## Background output worker: np.savez, figure and animation writes run in a thread pool
+## with a bounded number of pending jobs, so the time stepping does not wait on the disk
+import threading
+import concurrent.futures
+
+import numpy as np
+
+from utils import telemetry
+
+class OutputWorker:
+    """
+    Thread pool for output jobs. submit() blocks once `max_pending` jobs are queued or
+    running, which bounds the memory held by pending arrays and figures.
+    Errors of the jobs are re-raised by flush().
+
+    Threads (not processes) are used: numpy file writes, zlib and Agg rendering release
+    the GIL for most of their work, and no array has to be pickled to another process.
+    """
+    def __init__(self, max_workers=2, max_pending=8):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="output")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, func, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        return future
+
+    def flush(self):
+        """
+        Waits for all submitted jobs and re-raises the first error.
+        """
+        futures, self._futures = self._futures, []
+        if not futures:
+            return
+        with telemetry.stage("io_flush"):
+            concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+# the worker of this process; None = synchronous output
+_worker = None
+
+def configure(enabled=True, max_workers=2, max_pending=8):
+    """
+    Enables (or disables) background output. Pending jobs of a previous worker are flushed.
+    """
+    global _worker
+    if _worker is not None:
+        if enabled and (_worker.max_workers, _worker.max_pending) == (max_workers, max_pending):
+            return _worker
+        _worker.shutdown()
+        _worker = None
+    if enabled:
+        _worker = OutputWorker(max_workers=max_workers, max_pending=max_pending)
+    return _worker
+
+def submit(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) in the background worker, or right away if it is disabled.
+    The caller must not modify the arguments afterwards (see save_npz() for arrays).
+    """
+    if _worker is None:
+        func(*args, **kwargs)
+        return None
+    return _worker.submit(func, *args, **kwargs)
+
+def flush():
+    """
+    Waits until everything submitted so far is written (call at the end of a task).
+    """
+    if _worker is not None:
+        _worker.flush()
+
+def save_npz(file, **arrays):
+    """
+    np.savez in the background. The arrays are copied, so the caller may reuse its buffers.
+    """
+    arrays = {k: np.array(v) for k, v in arrays.items()}
+    return submit(np.savez, file, **arrays)
+
+def savefig(fig, filename, **kwargs):
+    """
+    fig.savefig() in the background. The figure must be closed first (plt.close(fig)) and not
+    be drawn or modified afterwards. It gets a fresh Agg canvas here, on the calling thread,
+    so the worker never touches a GUI canvas or pyplot state while pyplot keeps drawing.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg # matplotlib only when figures are saved
+
+    FigureCanvasAgg(fig)
+    return submit(fig.savefig, filename, **kwargs)
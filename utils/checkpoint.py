@@ -0,0 +1,162 @@
+## Field checkpoint / restart of long runs (built on sim.dump / sim.load)
+import os
+import json
+import pickle
+import shutil
+
+from utils.mpi_utils import am_master, barrier, broadcast_flag, timed_run
+from utils import telemetry
+
+class Checkpointer:
+    """
+    Periodically dumps the MEEP field state (and the state of the observers)
+    of a run, so that the run can be resumed after a crash or wall-time kill,
+    extended by more time, or branched into several post-processing runs.
+
+    Layout of the checkpoint directory:
+        checkpoint.json        - simulation time, time step, parameter hash and the
+                                 step directory holding the checkpoint ("dir")
+        step_<n>/observers.pkl - state of the observers (running max, buffers, ...) and of a
+                                 stateful stop condition (SteadyStateMonitor)
+        step_<n>/<MEEP dump>   - fields and structure written by sim.dump()
+
+    Every checkpoint is written into a new step directory; checkpoint.json is replaced
+    atomically only after that, so a run killed while dumping resumes from the previous
+    checkpoint. A checkpoint is only accepted if it was written with the same parameters
+    (SimParams.params_hash()).
+    """
+    META_FILE = "checkpoint.json"
+    OBSERVERS_FILE = "observers.pkl"
+
+    def __init__(self, singleton_params, dirname, interval):
+        self.singleton_params = singleton_params
+        self.dirname = dirname
+        self.interval = interval
+        self._current = None # step directory of the last checkpoint saved or loaded
+
+    @classmethod
+    def for_run(cls, singleton_params, label):
+        """
+        Checkpointer of the run `label` in <path_to_save>/checkpoints/<label>,
+        or None if singleton_params.checkpoint_interval is not set.
+        """
+        if not singleton_params.checkpoint_interval:
+            return None
+        return cls(singleton_params,
+                   os.path.join(singleton_params.path_to_save, "checkpoints", label),
+                   singleton_params.checkpoint_interval)
+
+    def exists(self):
+        # decided on master, all ranks must agree on loading (collective) or not
+        return broadcast_flag(os.path.exists(os.path.join(self.dirname, self.META_FILE)))
+
+    def meta(self):
+        with open(os.path.join(self.dirname, self.META_FILE)) as f:
+            return json.load(f)
+
+    @telemetry.stage("io")
+    def save(self, sim, observers=()):
+        step_dir = f"step_{sim.timestep()}"
+        if step_dir == self._current:
+            return # nothing was stepped since the last checkpoint
+        path = os.path.join(self.dirname, step_dir)
+        if am_master():
+            os.makedirs(path, exist_ok=True)
+        barrier()
+        sim.dump(path, dump_structure=True, dump_fields=True) # collective
+        barrier() # every rank has finished writing its part of the fields
+        if am_master():
+            with open(os.path.join(path, self.OBSERVERS_FILE), "wb") as f:
+                pickle.dump([o.get_state() for o in observers], f)
+            tmp = os.path.join(self.dirname, self.META_FILE + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump({"time": sim.meep_time(),
+                           "timestep": sim.timestep(),
+                           "params_hash": self.singleton_params.params_hash(),
+                           "dir": step_dir}, f, indent=2)
+            os.replace(tmp, os.path.join(self.dirname, self.META_FILE)) # the checkpoint is complete
+            # previous checkpoints and dumps of killed runs
+            for name in os.listdir(self.dirname):
+                if name.startswith("step_") and name != step_dir:
+                    shutil.rmtree(os.path.join(self.dirname, name), ignore_errors=True)
+        self._current = step_dir
+
+    def load(self, sim, observers=()):
+        """
+        Loads the checkpoint into a not yet initialised simulation (e.g. fresh from make_sim()
+        or after sim.reset_meep()) and restores the observers. Returns the checkpoint metadata.
+        """
+        meta = self.meta()
+        if meta["params_hash"] != self.singleton_params.params_hash():
+            raise ValueError(f"Checkpoint {self.dirname} was written with different parameters.")
+        path = os.path.join(self.dirname, meta.get("dir", "")) # checkpoints without "dir": flat layout
+        with telemetry.stage("io"):
+            sim.load(path, load_structure=True, load_fields=True)
+            sim.init_sim() # performs the delayed load, so meep_time() is the checkpoint time
+        if observers:
+            with open(os.path.join(path, self.OBSERVERS_FILE), "rb") as f:
+                for o, state in zip(observers, pickle.load(f)):
+                    o.set_state(state)
+        self._current = meta.get("dir")
+        return meta
+
+    def run(self, sim, until, step_funcs=(), observers=(), resume=True, label="run"):
+        """
+        Runs the simulation up to `until` (time from t=0, or a stop condition callable),
+        dumping a checkpoint every `interval`. With resume=True an existing checkpoint
+        is loaded first and the run continues from its time instead of t=0.
+        """
+        sim.reset_meep()
+        if resume and self.exists():
+            if broadcast_flag(am_master() and self.meta()["params_hash"] == self.singleton_params.params_hash()):
+                t = self.load(sim, self._stateful(until, observers))["time"]
+                print(f"Checkpoint: resuming '{label}' from t={t}")
+            else:
+                print(f"Checkpoint: ignoring stale checkpoint of '{label}' (parameters changed)")
+        return self._run_chunks(sim, until, step_funcs, observers, label)
+
+    @staticmethod
+    def _stateful(until, observers):
+        """
+        The objects saved with a checkpoint: the observers and a stop condition with a state.
+        """
+        return list(observers) + ([until] if hasattr(until, "get_state") else [])
+
+    def extend(self, sim, extra_time, step_funcs=(), observers=(), label="run"):
+        """
+        Continues a finished (checkpointed) run by extra_time.
+        """
+        sim.reset_meep()
+        t = self.load(sim, observers)["time"]
+        return self._run_chunks(sim, t + extra_time, step_funcs, observers, label)
+
+    def branch(self, sim):
+        """
+        Loads the warmed-up state into `sim` so that several post-processing runs
+        (e.g. run_observers(..., reset=False)) can start from the same steady state.
+        The checkpoint itself is left untouched.
+        """
+        sim.reset_meep()
+        return self.load(sim)
+
+    def _run_chunks(self, sim, until, step_funcs, observers, label):
+        stop = until if callable(until) else None
+        stopped = False
+
+        def chunk_condition(chunk_end):
+            def _cond(sim):
+                nonlocal stopped
+                if stop is not None and stop(sim):
+                    stopped = True
+                    return True
+                return sim.meep_time() >= chunk_end
+            return _cond
+
+        while not stopped:
+            t = sim.meep_time() if sim.fields is not None else 0.0
+            if stop is None and t >= until - 1e-12:
+                break
+            chunk_end = t + self.interval if stop is not None else min(t + self.interval, until)
+            timed_run(sim, label, *step_funcs, until=chunk_condition(chunk_end))
+            self.save(sim, self._stateful(until, observers))
+        return sim
@@ -0,0 +1,113 @@
+## Convergence-based adaptive stopping of the time stepping
+import meep as mp
+import numpy as np
+
+# results of the adaptive runs of this process: label -> SteadyStateMonitor.result()
+convergence_log = {}
+
+class SteadyStateMonitor:
+    """
+    MEEP stop condition (use as `sim.run(until=monitor)`) that ends the run once
+    the field at a cheap probe point has reached steady state.
+
+    Every time step the probe amplitude |E(point)| is read; its peak over each
+    source period is stored. The run is converged when the relative change of the
+    peak amplitude between consecutive periods stayed below `tol` for the last
+    `n_periods` periods (and at least `min_time` has passed). The run is stopped
+    at `max_time` regardless, and is then reported as not converged.
+
+    Attributes:
+        converged (bool): Whether steady state was reached.
+        rel_change (float): Last measured relative period-to-period change.
+        stop_time (float): Simulation time at which the run stopped.
+    """
+    def __init__(self, component, freq, point=None, tol=1e-3, n_periods=3,
+                 min_time=0.0, max_time=None, label="run"):
+        self.component = component
+        self.period = 1.0 / freq
+        self.point = mp.Vector3() if point is None else point
+        self.tol = tol
+        self.n_periods = n_periods
+        self.min_time = min_time
+        self.max_time = max_time
+        self.label = label
+
+        self.converged = False
+        self.rel_change = np.inf
+        self.stop_time = None
+        self._t0 = None
+        self._period_idx = 0
+        self._period_peak = 0.0
+        self._peaks = []
+
+    def _check(self):
+        if len(self._peaks) < self.n_periods + 1 or self._peaks[-1] == 0:
+            return False
+        recent = np.asarray(self._peaks[-(self.n_periods + 1):])
+        self.rel_change = float(np.max(np.abs(np.diff(recent))) / recent[-1])
+        return self.rel_change < self.tol
+
+    def __call__(self, sim):
+        t = sim.meep_time()
+        if self._t0 is None:
+            self._t0 = t # run() durations are relative to the start of the run
+
+        period_idx = int((t - self._t0) / self.period)
+        if period_idx != self._period_idx:
+            self._peaks.append(self._period_peak)
+            self._period_idx = period_idx
+            self._period_peak = 0.0
+            if t - self._t0 >= self.min_time and self._check():
+                self.converged = True
+                return self._stop(t)
+        self._period_peak = max(self._period_peak, abs(sim.get_field_point(self.component, self.point)))
+
+        if self.max_time is not None and t - self._t0 >= self.max_time:
+            print(f"Warning: '{self.label}' not converged after {self.max_time} "
+                  f"(relative change {self.rel_change:.2e} > tol {self.tol:.0e}).")
+            return self._stop(t)
+        return False
+
+    def _stop(self, t):
+        self.stop_time = t
+        convergence_log[self.label] = self.result()
+        return True
+
+    def result(self):
+        return {"converged": self.converged,
+                "rel_change": self.rel_change,
+                "tol": self.tol,
+                "stop_time": self.stop_time,
+                "amplitude": self._peaks[-1] if self._peaks else None}
+
+    # progress of the monitor; the settings come from the parameters of the resumed run
+    _state = ("converged", "rel_change", "stop_time", "_t0", "_period_idx", "_period_peak", "_peaks")
+
+    def get_state(self):
+        """
+        Picklable progress of the monitor, saved with field checkpoints (see utils.checkpoint),
+        so a resumed run keeps its start time and the period peaks measured so far.
+        """
+        return {k: getattr(self, k) for k in self._state}
+
+    def set_state(self, state):
+        self.__dict__.update(state)
+
+def make_stop_condition(singleton_params, until, label="run", min_time=0.0):
+    """
+    Returns `until` unchanged, or a SteadyStateMonitor probing the gap centre
+    if singleton_params.adaptive_stop is set.
+
+    Args:
+        until (float): Fixed run time used without adaptive stopping.
+        label (str): Name under which the achieved convergence is logged.
+        min_time (float): Shortest allowed run (e.g. the skipped transient of a collector).
+    """
+    if not singleton_params.adaptive_stop:
+        return until
+    return SteadyStateMonitor(singleton_params.component, singleton_params.freq,
+                              tol=singleton_params.convergence_tol,
+                              n_periods=singleton_params.convergence_periods,
+                              min_time=min_time,
+                              max_time=singleton_params.max_sim_time,
+                              label=label)
@@ -0,0 +1,256 @@
+## Appendable, chunked on-disk store of field frames
+import os
+import json
+import numpy as np
+
+from utils.mpi_utils import am_master
+from utils import telemetry
+from utils import async_io
+
+class FrameStore:
+    """
+    Appendable time series of equally shaped field frames, stored on disk in chunks.
+
+    Layout of the store directory:
+        meta.json            - frame shape, dtype, chunk size, number of frames
+        times.npy            - simulation time of every frame
+        chunk_000000.npy     - frames [0, chunk_frames)            (uncompressed)
+        chunk_000001.npz     - frames [chunk_frames, 2*chunk_frames) (compressed)
+        ...
+
+    Frames are written incrementally - only the chunk being filled is kept in memory
+    (plus the chunks queued in the background output worker, see utils.async_io).
+    Under MPI only the master rank touches the disk.
+    Uncompressed chunks are read memory-mapped, so any time or spatial slice can be
+    accessed without loading the whole history.
+
+    Example:
+        >>> store = FrameStore("results/frames_Ey", mode="w", chunk_frames=64)
+        >>> store.append(E_data, t)
+        >>> store.close()
+        >>> frames = FrameStore("results/frames_Ey")
+        >>> frames[10:20, :, 100]   # time slice x spatial slice
+    """
+    META_FILE = "meta.json"
+    TIMES_FILE = "times.npy"
+
+    def __init__(self, path, mode="r", chunk_frames=64, compress=False, dtype=None):
+        """
+        Args:
+            path (str): Directory of the store.
+            mode (str): "r" read, "w" create (overwrites), "a" append to an existing store.
+            chunk_frames (int): Number of frames per chunk file (new stores only).
+            compress (bool): Write compressed .npz chunks (not memory-mappable).
+            dtype (str or np.dtype): Storage dtype; defaults to the dtype of the first frame.
+        """
+        self.path = path
+        self.mode = mode
+        self._chunk_cache = {}
+        self._buffer = None
+        self._buffer_n = 0
+        self._flushed_n = 0  # frames of the buffer already on disk as a partial last chunk
+        self._times = []
+        self._pending = None # last queued write of this store
+
+        self._writer = am_master()
+
+        if mode == "w" or (mode == "a" and not os.path.exists(os.path.join(path, self.META_FILE))):
+            if self._writer:
+                os.makedirs(path, exist_ok=True)
+                for fname in os.listdir(path):
+                    if fname.startswith("chunk_") or fname in (self.META_FILE, self.TIMES_FILE):
+                        os.remove(os.path.join(path, fname))
+            self.meta = {"shape": None, "dtype": None if dtype is None else np.dtype(dtype).str,
+                         "chunk_frames": int(chunk_frames), "compress": bool(compress),
+                         "n_frames": 0, "chunks": []}
+        elif mode in ("r", "a"):
+            with open(os.path.join(path, self.META_FILE)) as f:
+                self.meta = json.load(f)
+            self._times = list(np.load(os.path.join(path, self.TIMES_FILE)))
+            if mode == "a" and self.meta["n_frames"] % self.meta["chunk_frames"]:
+                # re-open the last, partially filled chunk for appending (it is rewritten when it grows)
+                last = self._load_chunk(len(self.meta["chunks"]) - 1)
+                self._allocate_buffer()
+                self._buffer[:len(last)] = last
+                self._buffer_n = self._flushed_n = len(last)
+                self._chunk_cache = {}
+        else:
+            raise ValueError(f"Unknown FrameStore mode '{mode}'.")
+
+    # --- writing ---
+
+    def _allocate_buffer(self):
+        self._buffer = np.empty((self.meta["chunk_frames"],) + tuple(self.meta["shape"]),
+                                dtype=np.dtype(self.meta["dtype"]))
+        self._buffer_n = 0
+
+    def append(self, frame, t=None):
+        """
+        Appends one frame (and its simulation time) to the store.
+        """
+        if self.mode == "r":
+            raise IOError("FrameStore opened read-only.")
+        frame = np.asarray(frame)
+        if self.meta["shape"] is None:
+            self.meta["shape"] = list(frame.shape)
+            if self.meta["dtype"] is None:
+                self.meta["dtype"] = frame.dtype.str
+        elif list(frame.shape) != self.meta["shape"]:
+            raise ValueError(f"Frame shape {frame.shape} does not match store shape {tuple(self.meta['shape'])}.")
+        if self._buffer is None:
+            self._allocate_buffer()
+
+        self._buffer[self._buffer_n] = frame
+        self._buffer_n += 1
+        self._times.append(np.nan if t is None else t)
+        if self._buffer_n == self.meta["chunk_frames"]:
+            self._write_chunk()
+
+    @telemetry.stage("io")
+    def _write_chunk(self):
+        """
+        Writes the buffer as a chunk. A partial chunk (flush()) stays in the buffer and is
+        rewritten under the same index once more frames arrive, so every chunk but the
+        last always holds exactly chunk_frames frames.
+        """
+        if self._buffer_n == self._flushed_n:
+            return
+        idx = len(self.meta["chunks"]) - (1 if self._flushed_n else 0)
+        fname = f"chunk_{idx:06d}.npz" if self.meta["compress"] else f"chunk_{idx:06d}.npy"
+        if self._writer:
+            # copied, the buffer is refilled while the chunk is written
+            self._submit(self._save_chunk, os.path.join(self.path, fname),
+                         self._buffer[:self._buffer_n].copy(), self.meta["compress"])
+        if self._flushed_n:
+            self._chunk_cache.pop(idx, None)
+        else:
+            self.meta["chunks"].append(fname)
+        self.meta["n_frames"] += self._buffer_n - self._flushed_n
+        if self._buffer_n == self.meta["chunk_frames"]:
+            self._buffer_n = self._flushed_n = 0
+        else:
+            self._flushed_n = self._buffer_n
+        self._write_meta()
+
+    def _write_meta(self):
+        if not self._writer:
+            return
+        self._submit(self._save_meta, json.loads(json.dumps(self.meta)),
+                     np.asarray(self._times[:self.meta["n_frames"]], dtype=float))
+
+    def _submit(self, func, *args):
+        # the writes of one store run in order (the meta never lists a chunk not yet written),
+        # even if the output worker has several threads
+        previous = self._pending
+        def job():
+            if previous is not None:
+                previous.result()
+            func(*args)
+        self._pending = async_io.submit(job)
+
+    @staticmethod
+    def _save_chunk(fname, data, compress):
+        # replaced atomically - a rewritten partial chunk may still be memory-mapped by a reader
+        tmp = fname + ".tmp"
+        with open(tmp, "wb") as f:
+            if compress:
+                np.savez_compressed(f, frames=data)
+            else:
+                np.save(f, data)
+        os.replace(tmp, fname)
+
+    def _save_meta(self, meta, times):
+        np.save(os.path.join(self.path, self.TIMES_FILE), times)
+        with open(os.path.join(self.path, self.META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def flush(self):
+        """
+        Writes the partially filled chunk (the store stays appendable - later frames
+        complete the same chunk) and waits until all queued writes of the store are on disk.
+        """
+        if self.mode != "r":
+            self._write_chunk()
+            self._write_meta()
+            if self._pending is not None:
+                self._pending.result()
+                self._pending = None
+
+    def close(self):
+        self.flush()
+        if self.mode != "r":
+            self.mode = "r" # reopen with mode="a" to append again
+        self._buffer = None
+        self._chunk_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- reading ---
+
+    def _load_chunk(self, idx):
+        if idx not in self._chunk_cache:
+            fname = os.path.join(self.path, self.meta["chunks"][idx])
+            if fname.endswith(".npz"):
+                with np.load(fname) as data:
+                    self._chunk_cache = {idx: data["frames"]} # keep at most one decompressed chunk
+            else:
+                self._chunk_cache[idx] = np.load(fname, mmap_mode="r")
+        return self._chunk_cache[idx]
+
+    def __len__(self):
+        return self.meta["n_frames"]
+
+    @property
+    def shape(self):
+        return (len(self),) + tuple(self.meta["shape"] or ())
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta["dtype"])
+
+    @property
+    def times(self):
+        return np.asarray(self._times[:len(self)], dtype=float)
+
+    def __getitem__(self, key):
+        """
+        Reads frames lazily. The first index selects time (int, slice or index array),
+        the remaining ones are applied to each frame, e.g. store[::10, 100:200, :].
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        t_key, spatial = key[0], key[1:]
+
+        t_idx = np.arange(len(self))[t_key]
+        scalar = np.ndim(t_idx) == 0
+        t_idx = np.atleast_1d(t_idx)
+
+        chunk_frames = self.meta["chunk_frames"]
+        chunk_of = t_idx // chunk_frames
+        out, positions = [], []
+        for c in np.unique(chunk_of):
+            pos = np.nonzero(chunk_of == c)[0]
+            local = t_idx[pos] - c * chunk_frames
+            out.append(np.asarray(self._load_chunk(int(c))[(local,) + spatial]))
+            positions.append(pos)
+        if not out:
+            return np.empty((0,) + tuple(self.meta["shape"] or ()), dtype=self.dtype)
+        # restore the requested (possibly non-monotonic) time order
+        grouped = np.concatenate(out)
+        data = np.empty_like(grouped)
+        data[np.concatenate(positions)] = grouped
+        return data[0] if scalar else data
+
+    def iter_chunks(self):
+        """
+        Yields (times, frames) for each stored chunk - for out-of-core processing.
+        """
+        chunk_frames = self.meta["chunk_frames"]
+        times = self.times
+        for c in range(len(self.meta["chunks"])):
+            block = self._load_chunk(c)
+            yield times[c*chunk_frames:c*chunk_frames + len(block)], block
@@ -1,44 +1,16 @@
-import meep as mp
 import numpy as np
 import os
-
-from visualization.plotter import *
+import json
+
+# finish_figure, FigureQueue and show_data_img are re-exported for the tasks
+from visualization.figures import finish_figure, FigureQueue, show_data_img, plot_e_3d
+from utils.observers import *
+from utils.mpi_utils import save_npz
+from utils.convergence import make_stop_condition
+from utils.checkpoint import Checkpointer
 # !!!!!!!!! ---> from main.src.simulation import * # CANT IMPORT DUE TO CIRCULAR DEPENDENCY
 
-def show_data_img(datas_arr, abs_bool, norm_bool, cmap_arr, alphas, name_to_save=None, IMG_CLOSE=False):
-    """
-    Displays a series of images from a given array of data.
-
-    Parameters:
-    datas_arr (list of np.ndarray): A list of 2D arrays containing the data to be visualized.
-    norm_bool (list of bool): A list of boolean values indicating whether to normalize each corresponding data array.
-    cmap_arr (list of str): A list of colormap names to be used for each corresponding data array.
-    alphas (list of float): A list of alpha values for transparency for each corresponding data array.
-
-    The function iterates through the provided data arrays, normalizes them if specified, 
-    and displays each image using matplotlib's imshow function with the specified colormap 
-    and transparency settings. The x and y axis ticks are turned off for a cleaner visualization.
-    """
-    for idx, data in enumerate(datas_arr):
-        if abs_bool[idx]:
-            data = np.abs(data) # complex -> real
-        if norm_bool[idx]:
-            max_data = np.max(data)
-            data = data / max_data # complex -> real
-        plt.imshow(data.transpose(), interpolation="spline36", cmap=cmap_arr[idx], alpha=alphas[idx])
-        plt.xticks([])  # Turn off x-axis numbers
-        plt.yticks([])  # Turn off y-axis numbers
-        plt.colorbar(shrink=0.6)  # Show color scale
-    if name_to_save is not None:
-        plt.savefig(f"{name_to_save}.png", dpi=300, bbox_inches="tight", format="png")
-    if IMG_CLOSE:
-        plt.show(block=False)
-        plt.pause(2)
-        plt.close("all")
-    else:
-        plt.show()
-    
-def make_animation(singleton_params, sim, animation_name):
+def make_animation(singleton_params, sim, animation_name, streaming=False):
     """
     Generates an animation of the simulation fields and saves it as an MP4 file.
 
@@ -48,22 +20,30 @@ def make_animation(singleton_params, sim, animation_name):
                                     animations_folder_path, and animations_fps.
         sim (object): The simulation object that is being animated.
         animation_name (str): The name of the animation file (without extension).
+        streaming (bool): Pipe NumPy colour-mapped frames straight to ffmpeg (VideoObserver)
+                          instead of recording them with mp.Animate2D.
 
     Returns:
         None: This function does not return a value. It saves the animation to the specified path.
     """
-    animation_name = animation_name + ".mp4"
-    sim.reset_meep()
-    animate = mp.Animate2D(sim, fields=singleton_params.component, normalize = True)
-    sim.run(mp.at_every(singleton_params.animations_step*10, animate), until=singleton_params.animations_until)
-    animate.to_mp4(filename = os.path.join(singleton_params.animations_folder_path, animation_name), fps = singleton_params.animations_fps)
-    plt.show(block=False)
-    plt.pause(2)
-    plt.close("all")
-
-def collect_e_line(singleton_params, sim, delta_t, width=1, plot_3d=False, name=None):
+    run_observers(sim, [animation_observer(singleton_params, sim, animation_name, streaming)])
+
+def animation_observer(singleton_params, sim, animation_name, streaming=False, vmax=None):
+    """
+    VideoObserver (frames piped to ffmpeg, constant memory) if streaming,
+    otherwise the matplotlib-based AnimationObserver.
+
+    Args:
+        vmax (float): Fixed colour range of the VideoObserver, e.g. max |E| of an earlier field.
+    """
+    if streaming:
+        return VideoObserver(singleton_params, animation_name, vmax=vmax)
+    return AnimationObserver(singleton_params, sim, animation_name)
+
+def collect_e_line(singleton_params, sim, delta_t, width=1, plot_3d=False, name=None, decimation=None):
     """
     Collect E component along center line (x_0:x_end, 0, 0) at intervals of delta_t.
+    Only the strip around the centre line is requested from MEEP (see LineProfileObserver).
     The returned ey_line is the mean across a vertical "width":
       - width=1 -> only the center row
       - width=2 -> center row plus rows at +/-1 (3 rows total)
@@ -72,45 +52,15 @@ def collect_e_line(singleton_params, sim, delta_t, width=1, plot_3d=False, name=
         delta_t: Time interval between data collections
         width: integer >=1 controlling how many rows (orders) to include
         plot_3d: Whether to plot the collected data in 3D
+        decimation: Optional Decimation (time/space stride, block average, storage dtype)
     Returns:
-        collected_data: List (time) of 1D arrays (x) with mean Ey
-        time_steps: List of time values
+        collected_data: (time, x) array with mean Ey
+        time_steps: Array of time values
         x_coords: Array of x coordinates along the line
     """
-    collected_data = []
-    time_steps = []
-    x_coords = None
-
-    def collect_data(sim):
-        nonlocal x_coords
-        E_data = sim.get_array(center=mp.Vector3(), size=singleton_params.xyz_cell, component=singleton_params.component)
-        # E_data shape: (nx, ny)  (may be 2D)
-        nx = E_data.shape[0]
-        ny = E_data.shape[1]
-        center_j = ny // 2
-
-        # compute offsets: for width=1 -> [0], width=2 -> [-1,0,1], etc.
-        max_order = max(0, width - 1)
-        offsets = [o for o in range(-max_order, max_order + 1)
-                   if 0 <= center_j + o < ny]
-
-        # select the rows and average across them (axis=1 -> per-x mean)
-        rows = E_data[:, [center_j + o for o in offsets]]
-        if rows.ndim == 1:
-            e_line = rows.copy()
-        else:
-            e_line = np.mean(rows, axis=1)
-
-        collected_data.append(e_line)
-        time_steps.append(sim.meep_time())
-
-        if x_coords is None:
-            # use actual simulation cell x-extent
-            x_extent = singleton_params.xyz_cell[0]
-            x_coords = np.linspace(-x_extent/2, x_extent/2, e_line.shape[0])
-    
-    sim.reset_meep()
-    sim.run(mp.at_every(delta_t, collect_data), until=singleton_params.animations_until)
+    line = LineProfileObserver(singleton_params, delta_t, width=width, decimation=decimation)
+    run_observers(sim, [line])
+    collected_data, time_steps, x_coords = line.collected_data, line.time_steps, line.x_coords
 
     if len(collected_data) == 0:
         return collected_data, time_steps, None
@@ -121,98 +71,81 @@ def collect_e_line(singleton_params, sim, delta_t, width=1, plot_3d=False, name=
 
     return collected_data, time_steps, x_coords
 
-def plot_e_3d(collected_data, x_coords, time_steps, name=None, IMG_CLOSE=False):
-    """
-    Plot E component in 3D: x axis, time axis, z axis (E magnitude)
-    
-    Args:
-        collected_data: List of E field arrays at each time step
-        x_coords: Array of x coordinates
-        time_steps: List of time values
-    """   
-    # Create meshgrid for 3D plot
-    X, T = np.meshgrid(x_coords, time_steps)
-    Z = np.abs(np.array(collected_data))
-    
-    fig = plt.figure(figsize=(14, 8))
-    ax = fig.add_subplot(111, projection='3d')
-    
-    # Plot surface
-    surf = ax.plot_surface(X, T, Z, cmap='viridis', alpha=0.9, edgecolor='none')
-    
-    ax.set_xlabel('x coordinate')
-    ax.set_ylabel('time')
-    ax.set_zlabel('|Ey|')
-    ax.set_title('Ey Component vs Time')
-    
-    fig.colorbar(surf, ax=ax, shrink=0.5, aspect=5)
-    
-    # Adjust viewpoint: elev controls vertical angle, azim controls horizontal angle
-    ax.view_init(elev=20, azim=45)
-    plt.savefig(name, dpi=300, bbox_inches="tight", format="png")
-    if IMG_CLOSE:
-        plt.show(block=False)
-        plt.pause(2)
-        plt.close("all")
-    else:
-        plt.show()
-    
-def collect_max_field(singleton_params, sim, delta_t, skip_fraction=0.5, optional_name="NAME"):
+def collect_max_field(singleton_params, sim, delta_t, skip_fraction=0.5, optional_name="NAME",
+                      save_frames=False, max_saved_frames=100, track_time_of_max=False,
+                      return_stats=False, frame_store_path=None, decimation=None):
     """
     Collects the maximum value of the component field at each spatial point 
     across the simulation duration, skipping the first skip_fraction of time.
 
+    The reduction is streaming: frames are folded into running max/RMS buffers
+    as they arrive, so peak memory is O(one frame) regardless of run length.
+
     Parameters:
-        singleton_params (object): Singleton with component, xyz_cell, animations_until
+        singleton_params (object): Singleton with component, output_volume(), animations_until
         sim (object): MEEP simulation object
         skip_fraction (float): Fraction of simulation time to skip (default 0.25 = 25%)
         delta_t (float): Time interval between data collections
+        save_frames (bool): If True, a bounded subset of |E| frames is saved to
+                            anim_collected_data_<optional_name>.npz
+        max_saved_frames (int): Upper bound on the number of saved frames; frames are
+                                evenly decimated in time to stay within it
+        track_time_of_max (bool): If True, also record the time at which the maximum was reached
+        return_stats (bool): If True, return (E_max, stats) where stats is a dict with
+                             "E_rms", "t_max" and "n_frames"
+        frame_store_path (str): If set, the full |E| history is written incrementally to a
+                                chunked FrameStore in this directory (bounded RAM)
+        decimation (Decimation): Reduces the saved frames and the frame store (time/space
+                                 stride, block average, storage dtype); E_max stays full-resolution
 
     Returns:
         E_max (np.ndarray): 2D array with maximum field magnitude at each point
     """
-    collected_data = []
     skip_time = singleton_params.animations_until * skip_fraction
-
-    def collect_data(sim):
-        current_time = sim.meep_time()
-        
-        if current_time >= skip_time:
-            E_data = sim.get_array(center=mp.Vector3(), 
-                                   size=singleton_params.xyz_cell, 
-                                   component=singleton_params.component)
-            collected_data.append(np.abs(E_data))
-
-    sim.reset_meep()
-    sim.run(mp.at_every(delta_t, collect_data), until=singleton_params.animations_until)
-
-    if len(collected_data) == 0:
+    store = FrameStore(frame_store_path, mode="w") if frame_store_path is not None else None
+    observer = MaxFieldObserver(singleton_params, delta_t, skip_time=skip_time, save_frames=save_frames,
+                                max_saved_frames=max_saved_frames, track_time_of_max=track_time_of_max,
+                                store=store, decimation=decimation)
+    until = make_stop_condition(singleton_params, singleton_params.animations_until,
+                                label=f"max_field_{optional_name}", min_time=skip_time)
+    run_observers(sim, [observer], until=until,
+                  checkpoint=Checkpointer.for_run(singleton_params, f"max_field_{optional_name}"))
+    return max_field_results(singleton_params, observer, optional_name, return_stats)
+
+def max_field_results(singleton_params, observer, optional_name="NAME", return_stats=False):
+    """
+    Post-processes a finished MaxFieldObserver: saves the bounded frame history (if any)
+    and returns the edge-masked maximum field (and statistics if return_stats).
+    """
+    stats = observer.stats
+    if stats.n_frames == 0:
         print("Warning: No data collected after skipping initial time!")
-        return None
-
-    # Initialize E_maxes as a zero array with the same shape as collected_data[0]
-    E_maxes = np.zeros_like(collected_data[0], dtype=float)
-
-    np.savez(
-        os.path.join(singleton_params.path_to_save, "anim_collected_data_f{optional_name}.npz"),
-        current_data = collected_data
-        )
-    
-    # For each time step, update E_maxes if the current value is greater
-    for i in range(len(collected_data)):
-        current_data = collected_data[i]
-        # print(f"CURRENT DATA: {current_data[100,100]}")
-        # print(f"CURRENT MAXES: {E_maxes[100,100]}")
-        E_maxes = np.maximum(E_maxes, current_data)
+        return (None, None) if return_stats else None
+
+    if observer.saved_frames is not None:
+        save_npz(
+            os.path.join(singleton_params.path_to_save, f"anim_collected_data_{optional_name}.npz"),
+            current_data = observer.saved_frames[:len(observer.saved_times)],
+            time_steps = np.array(observer.saved_times),
+            decimation = json.dumps(observer.decimation.report() if observer.decimation is not None else None)
+            )
     
     # Zero the frame of width `frame_width` from each edge
     frame_width = 20
-    if frame_width > 0:
-        # Top and bottom edges
-        E_maxes[:frame_width, :] = 0
-        E_maxes[-frame_width:, :] = 0
-        # Left and right edges
-        E_maxes[:, :frame_width] = 0
-        E_maxes[:, -frame_width:] = 0
-
-    return E_maxes
\ No newline at end of file
+    E_maxes = zero_frame_edges(stats.E_max, frame_width)
+
+    if return_stats:
+        return E_maxes, {"E_rms": zero_frame_edges(stats.rms(), frame_width),
+                         "t_max": stats.t_max,
+                         "n_frames": stats.n_frames}
+    return E_maxes
+
+def gap_center_value(data):
+    """
+    Returns the value of a 2D field map at the centre of the cell,
+    which for the split-bar antenna is the centre of the gap.
+    """
+    if data is None:
+        return None
+    data = np.asarray(data)
+    return data[data.shape[0] // 2, data.shape[1] // 2]
@@ -0,0 +1,151 @@
+## Helpers for running under mpirun: the simulation runs on all ranks,
+## I/O, plotting and parameter dumps only on the master rank.
+import os
+import json
+import time
+import functools
+import numpy as np
+
+from utils import telemetry
+from utils import async_io
+
+# timing of every simulation run of this process, see timed_run()
+_run_log = []
+
+# serial helper process (e.g. a figure render worker) - see set_serial()
+_serial = False
+
+def set_serial():
+    """
+    Marks this process as a serial helper: am_master() and count_ranks() no longer import
+    meep, which would initialise MPI inside a process spawned by an MPI rank.
+    """
+    global _serial
+    _serial = True
+
+def am_master():
+    """
+    True on the master rank (and always True without MPI / without meep).
+    """
+    if _serial:
+        return True
+    try:
+        import meep as mp
+    except ImportError:
+        return True
+    return mp.am_master()
+
+def count_ranks():
+    if _serial:
+        return 1
+    try:
+        import meep as mp
+    except ImportError:
+        return 1
+    return mp.count_processors()
+
+def barrier():
+    """
+    Waits until every rank got here (no-op without MPI).
+    """
+    if count_ranks() > 1:
+        import meep as mp
+        mp.all_wait()
+
+def broadcast_flag(flag):
+    """
+    The master rank's value of `flag`, on every rank. For decisions the ranks must agree on
+    because they lead to collective MEEP calls, e.g. whether a file written by master exists.
+    """
+    if count_ranks() == 1:
+        return bool(flag)
+    import meep as mp
+    return mp.max_to_all(int(bool(flag)) if mp.am_master() else 0) > 0
+
+def master_only(func):
+    """
+    Decorator: the function is executed only on the master rank (returns None elsewhere).
+    Must not be used on functions that call collective MEEP operations.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if am_master():
+            return func(*args, **kwargs)
+        return None
+    return wrapper
+
+@master_only
+def makedirs(path):
+    os.makedirs(path, exist_ok=True)
+
+@master_only
+@telemetry.stage("io")
+def save_npz(file, **arrays):
+    """
+    np.savez executed only on the master rank (in the background if utils.async_io is enabled).
+    """
+    async_io.save_npz(file, **arrays)
+
+def timed_run(sim, label, *step_funcs, **run_kwargs):
+    """
+    sim.run(*step_funcs, **run_kwargs) that records the number of time steps, the wall
+    time and the rank count for the scaling report. The (re-)initialisation of the fields
+    after reset_meep() is timed separately as the geometry_init telemetry stage.
+    Callables in sim.init_hooks run once, with the initialised structure, before the first run
+    (e.g. the structure cache of simulation.make_sim()).
+    """
+    if sim.fields is None:
+        with telemetry.stage("geometry_init"):
+            sim.init_sim()
+    hooks = getattr(sim, "init_hooks", None)
+    if hooks:
+        sim.init_hooks = []
+        with telemetry.stage("io"):
+            for hook in hooks:
+                hook(sim)
+    n0 = sim.timestep()
+    t0 = time.time()
+    with telemetry.stage("stepping"): # the callbacks inside are recorded as their own stages
+        sim.run(*step_funcs, **run_kwargs)
+    wall = time.time() - t0
+    steps = sim.timestep() - n0
+    telemetry.add_timesteps(steps)
+    _run_log.append({"label": label,
+                     "ranks": count_ranks(),
+                     "resolution": sim.resolution,
+                     "timesteps": steps,
+                     "wall_s": wall,
+                     "timesteps_per_s": steps / wall if wall > 0 else None})
+    return wall
+
+@master_only
+def write_scaling_report(filename):
+    """
+    Appends the runs recorded by timed_run() to a JSON report, so runs with different
+    `mpirun -np` can be compared (see scaling_summary()).
+    """
+    report = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            report = json.load(f)
+    report.extend(_run_log)
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+    _run_log.clear()
+
+def scaling_summary(filename):
+    """
+    Returns {label: [(ranks, mean timesteps/s, speedup vs the smallest rank count), ...]}.
+    """
+    with open(filename) as f:
+        report = json.load(f)
+    by_label = {}
+    for entry in report:
+        if entry["timesteps_per_s"]:
+            by_label.setdefault(entry["label"], {}).setdefault(entry["ranks"], []).append(entry["timesteps_per_s"])
+    summary = {}
+    for label, per_rank in by_label.items():
+        ranks = sorted(per_rank)
+        base = np.mean(per_rank[ranks[0]])
+        summary[label] = [(r, float(np.mean(per_rank[r])), float(np.mean(per_rank[r]) / base)) for r in ranks]
+    return summary
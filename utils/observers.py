@@ -0,0 +1,594 @@
+## Observers fed by a single time-stepping pass of a MEEP simulation
+import meep as mp
+import numpy as np
+import os
+
+from visualization.plotter import plt, is_headless
+from utils.frame_store import FrameStore
+from utils.mpi_utils import am_master, timed_run
+from utils import telemetry
+from utils import async_io
+from utils.video import VideoWriter, colormap_lut, apply_lut
+
+class FieldStatsAccumulator:
+    """
+    Streaming reduction of field frames into running statistics.
+
+    Only preallocated buffers of the size of one frame are kept, so memory
+    does not grow with the number of collected time steps.
+
+    Attributes:
+        E_max (np.ndarray): Running maximum of |E| at each point.
+        E_sq_sum (np.ndarray): Running sum of |E|^2 at each point (used for RMS).
+        t_max (np.ndarray): Time at which E_max was reached (only if track_time_of_max).
+        n_frames (int): Number of frames accumulated so far.
+    """
+    def __init__(self, track_time_of_max=False):
+        self.track_time_of_max = track_time_of_max
+        self.E_max = None
+        self.E_sq_sum = None
+        self.t_max = None
+        self.n_frames = 0
+        self._abs_buf = None
+
+    def _allocate(self, shape):
+        self.E_max = np.zeros(shape, dtype=float)
+        self.E_sq_sum = np.zeros(shape, dtype=float)
+        self._abs_buf = np.empty(shape, dtype=float)
+        if self.track_time_of_max:
+            self.t_max = np.zeros(shape, dtype=float)
+
+    def update(self, E_data, t=None):
+        """
+        Adds one frame to the running statistics (in place).
+
+        Args:
+            E_data (np.ndarray): Field frame (real or complex).
+            t (float): Simulation time of the frame, needed for time-of-max.
+        """
+        if self.E_max is None:
+            self._allocate(E_data.shape)
+
+        np.abs(E_data, out=self._abs_buf)
+        if self.track_time_of_max:
+            self.t_max[self._abs_buf > self.E_max] = t
+        np.maximum(self.E_max, self._abs_buf, out=self.E_max)
+        np.square(self._abs_buf, out=self._abs_buf)
+        self.E_sq_sum += self._abs_buf
+        self.n_frames += 1
+
+    def rms(self):
+        """
+        Returns the RMS of |E| over all accumulated frames.
+        """
+        if self.E_sq_sum is None:
+            return None
+        return np.sqrt(self.E_sq_sum / max(self.n_frames, 1))
+
+def zero_frame_edges(data, frame_width):
+    """
+    Zeroes (in place) a frame of width `frame_width` from each edge of a 2D array.
+    Used to mask PML-affected regions of the field maps.
+    """
+    if frame_width > 0:
+        # Top and bottom edges
+        data[:frame_width, :] = 0
+        data[-frame_width:, :] = 0
+        # Left and right edges
+        data[:, :frame_width] = 0
+        data[:, -frame_width:] = 0
+    return data
+
+def block_average(data, block):
+    """
+    Averages non-overlapping blocks of `block` points along every axis
+    (trailing points that do not fill a block are dropped).
+    """
+    if block <= 1:
+        return data
+    shape, slices = [], []
+    for n in data.shape:
+        m = max(n // block, 1)
+        b = block if n >= block else n
+        slices.append(slice(0, m * b))
+        shape += [m, b]
+    return data[tuple(slices)].reshape(shape).mean(axis=tuple(range(1, 2 * data.ndim, 2)))
+
+class Decimation:
+    """
+    Reduction of the frames an observer keeps: every time_stride-th frame, every
+    space_stride-th grid point along each axis, block-averaged blocks of block points,
+    stored as `dtype`. The error of the reduced precision is measured on every frame.
+
+    Example:
+        >>> dec = Decimation(time_stride=4, block=2, dtype="float16")   # 64x smaller
+        >>> line = LineProfileObserver(p, delta_t=p.animations_step, width=5, decimation=dec)
+        >>> dec.report()["max_rel_error"]
+
+    Attributes:
+        max_abs_error (float): Largest absolute storage error of any stored value.
+        max_rel_error (float): Largest storage error relative to the frame's max |E|.
+    """
+    def __init__(self, time_stride=1, space_stride=1, block=1, dtype=None):
+        self.time_stride = int(time_stride)
+        self.space_stride = int(space_stride)
+        self.block = int(block)
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.max_abs_error = 0.0
+        self.max_rel_error = 0.0
+
+    @classmethod
+    def from_params(cls, settings):
+        """
+        Decimation from a dict such as p.history_decimation, or None for None / {}.
+        """
+        return cls(**settings) if settings else None
+
+    def spatial(self, data):
+        """
+        Applies only the spatial decimation (e.g. to coordinates).
+        """
+        if self.space_stride > 1:
+            data = data[(slice(None, None, self.space_stride),) * data.ndim]
+        return block_average(data, self.block)
+
+    def apply(self, frame):
+        frame = self.spatial(frame)
+        if self.dtype is None:
+            return frame
+        dtype = self.dtype
+        if np.iscomplexobj(frame) and dtype.kind == "f":
+            if dtype.itemsize < 4:
+                raise ValueError(f"No complex {dtype} - use float32 for complex fields.")
+            dtype = np.result_type(dtype, np.complex64)
+        stored = frame.astype(dtype)
+        err = float(np.max(np.abs(stored - frame))) if frame.size else 0.0
+        scale = float(np.max(np.abs(frame))) if frame.size else 0.0
+        self.max_abs_error = max(self.max_abs_error, err)
+        if scale > 0:
+            self.max_rel_error = max(self.max_rel_error, err / scale)
+        return stored
+
+    def report(self):
+        return {"time_stride": self.time_stride,
+                "space_stride": self.space_stride,
+                "block": self.block,
+                "dtype": None if self.dtype is None else self.dtype.name,
+                "max_abs_error": self.max_abs_error,
+                "max_rel_error": self.max_rel_error}
+
+class Observer:
+    """
+    Base class of the run pipeline observers.
+
+    An observer is called every `delta_t` while the simulation time is inside
+    [start, until] and gets a final `finalize(sim)` call after the run.
+    Subclasses implement `step(sim)` and optionally `finalize(sim)`. step() is called at
+    most once per simulation time: MEEP calls step functions again at the end of every
+    sim.run() and at the start of a run resumed from a checkpoint (see run_observers()).
+
+    Attributes:
+        delta_t (float): Time interval between calls of step().
+        start (float): Simulation time before which step() is not called.
+        until (float): Simulation time after which step() is not called.
+    """
+    def __init__(self, delta_t, start=0.0, until=None):
+        self.delta_t = delta_t
+        self.start = start
+        self.until = until
+        self._last_t = None # time of the last step() call, saved with checkpoints
+
+    def _in_window(self, t):
+        return t >= self.start and (self.until is None or t <= self.until)
+
+    def _guarded_step(self, sim):
+        t = sim.meep_time()
+        if self._last_t is not None and abs(t - self._last_t) < 0.5 * sim.fields.dt:
+            return # this time step was already recorded
+        if self._in_window(t):
+            self._last_t = t
+            with telemetry.stage("callbacks"):
+                self.step(sim)
+
+    def step_function(self):
+        """
+        Returns the MEEP step function that drives this observer.
+        """
+        return mp.at_every(self.delta_t, self._guarded_step)
+
+    def step(self, sim):
+        raise NotImplementedError
+
+    def finalize(self, sim):
+        pass
+
+    def close(self):
+        """
+        Releases open resources (files, encoder processes); called by run_observers()
+        after finalize() and also when the run raises.
+        """
+        pass
+
+    # attributes that are not part of a checkpoint (parameters, open files, figures)
+    _transient = ("singleton_params", "store", "animate", "video")
+
+    def get_state(self):
+        """
+        Picklable state of the observer, saved with field checkpoints.
+        """
+        return {k: v for k, v in self.__dict__.items() if k not in self._transient}
+
+    def set_state(self, state):
+        self.__dict__.update(state)
+
+class AnimationObserver(Observer):
+    """
+    Records mp.Animate2D frames and saves them as <animation_name>.mp4.
+    The observer must not be reused after finalize() (the mp4 may still be encoding).
+    """
+    def __init__(self, singleton_params, sim, animation_name, delta_t=None):
+        super().__init__(delta_t or singleton_params.animations_step*10,
+                         until=singleton_params.animations_until)
+        self.singleton_params = singleton_params
+        self.animation_name = animation_name + ".mp4"
+        plot_kwargs = {}
+        if singleton_params.dimensions == 3: # Animate2D needs a plane through the 3D cell
+            center, size = singleton_params.output_volume()
+            plot_kwargs["output_plane"] = mp.Volume(center=center, size=size)
+        self.animate = mp.Animate2D(sim, fields=singleton_params.component, normalize = True, **plot_kwargs)
+
+    def step(self, sim):
+        self.animate(sim, "step")
+
+    @telemetry.stage("plotting")
+    def finalize(self, sim):
+        self.animate(sim, "finish")
+        if am_master():
+            # the frames are already rendered - the mp4 is encoded in the background output worker
+            async_io.submit(self.animate.to_mp4,
+                            filename = os.path.join(self.singleton_params.animations_folder_path, self.animation_name),
+                            fps = self.singleton_params.animations_fps)
+            if not is_headless():
+                plt.show(block=False)
+                plt.pause(2)
+            plt.close("all")
+
+class VideoObserver(Observer):
+    """
+    Streams the E component on a region (default: the output volume) into
+    <animations_folder_path>/<animation_name>.mp4 while the simulation runs. Each frame is
+    colour-mapped with NumPy and piped to ffmpeg (see utils.video), so memory stays at one
+    frame and there is no matplotlib drawing per frame, unlike AnimationObserver.
+
+    All frames share one colour range [-vmax, vmax], so brightness is comparable between
+    frames. Pass vmax from an earlier field (e.g. max |E| of the task_0 snapshot); without it
+    the running maximum of |E| over the frames so far is used, which only ever grows.
+    mp.Animate2D(normalize=True) (AnimationObserver) instead rescales all frames by the
+    maximum of the whole run once it is over, which needs every frame in memory - a streamed
+    frame is already encoded. With show_structure the metal (Re eps < 0 at p.freq) is drawn
+    dark. A resumed checkpointed run starts a new video.
+    """
+    def __init__(self, singleton_params, animation_name, delta_t=None, center=None, size=None,
+                 cmap="RdBu", vmax=None, upscale=1, show_structure=True):
+        super().__init__(delta_t or singleton_params.animations_step*10,
+                         until=singleton_params.animations_until)
+        self.singleton_params = singleton_params
+        out_center, out_size = singleton_params.output_volume()
+        self.center = out_center if center is None else center
+        self.size = out_size if size is None else size
+        self.filename = os.path.join(singleton_params.animations_folder_path, animation_name + ".mp4")
+        self.lut = colormap_lut(cmap)
+        self.vmax = vmax
+        self.upscale = upscale
+        self.show_structure = show_structure
+        self.overlay = None
+        self.video = None
+        self._running_vmax = 0.0
+
+    def step(self, sim):
+        frame = sim.get_array(center=self.center, size=self.size, component=self.singleton_params.component)
+        if self.show_structure and self.overlay is None:
+            eps = sim.get_array(component=mp.Dielectric, center=self.center, size=self.size,
+                                frequency=self.singleton_params.freq)
+            self.overlay = np.real(eps) < 0
+        if not am_master():
+            return
+        if self.video is None:
+            self.video = VideoWriter(self.filename, fps=self.singleton_params.animations_fps, upscale=self.upscale)
+        if self.vmax is None:
+            self._running_vmax = max(self._running_vmax, float(np.max(np.abs(frame))))
+        vmax = self.vmax or self._running_vmax or 1.0
+        self.video.write(apply_lut(frame, self.lut, -vmax, vmax, self.overlay))
+
+    def finalize(self, sim):
+        self.close()
+
+    def close(self):
+        if self.video is not None:
+            video, self.video = self.video, None
+            video.close()
+
+class RegionMonitor(Observer):
+    """
+    Collects the E component on a region of interest only (a line, a thin strip
+    or an arbitrary box such as the gap), so the per-step cost scales with the
+    region rather than with the whole cell.
+
+    Frames are written into a (time, ...) buffer preallocated from the known
+    number of steps in [start, until]. With a Decimation, the monitor is called
+    only every time_stride-th delta_t and frames are reduced before storing.
+
+    Attributes:
+        center (mp.Vector3): Centre of the region.
+        size (mp.Vector3): Size of the region (zero extent -> line/plane).
+        reduce_axis (int): If set, frames are averaged along this axis before storing.
+        store (FrameStore): If set, frames are appended to this on-disk store instead
+                            of the in-memory buffer.
+        decimation (Decimation): Optional reduction of the stored frames.
+        frames (np.ndarray or FrameStore): The collected (time, ...) data.
+        times (np.ndarray): The collected time values.
+    """
+    def __init__(self, singleton_params, delta_t, center, size, start=0.0, until=None,
+                 component=None, reduce_axis=None, store=None, decimation=None):
+        if decimation is not None:
+            delta_t *= decimation.time_stride
+        super().__init__(delta_t, start=start, until=singleton_params.animations_until if until is None else until)
+        self.decimation = decimation
+        self.singleton_params = singleton_params
+        self.center = center
+        self.size = size
+        self.component = singleton_params.component if component is None else component
+        self.reduce_axis = reduce_axis
+        self.store = store
+        self.n_steps = int(np.floor((self.until - self.start) / delta_t + 1e-9)) + 2 # +1 for t=start, +1 margin
+        self._buffer = None
+        self._times = np.empty(self.n_steps, dtype=float)
+        self.n = 0
+
+    def _allocate(self, frame):
+        self._buffer = np.empty((self.n_steps,) + frame.shape, dtype=frame.dtype)
+
+    def _grow(self):
+        # only reached if MEEP fires more often than expected
+        self._buffer = np.concatenate([self._buffer, np.empty_like(self._buffer)])
+        self._times = np.concatenate([self._times, np.empty_like(self._times)])
+
+    def step(self, sim):
+        frame = sim.get_array(center=self.center, size=self.size, component=self.component)
+        if self.reduce_axis is not None and frame.ndim > self.reduce_axis:
+            frame = np.mean(frame, axis=self.reduce_axis)
+        if self.decimation is not None:
+            frame = self.decimation.apply(frame)
+        if self.store is not None:
+            self.store.append(frame, sim.meep_time())
+            self.n += 1
+            return
+        if self._buffer is None:
+            self._allocate(frame)
+        if self.n == self._buffer.shape[0]:
+            self._grow()
+        self._buffer[self.n] = frame
+        self._times[self.n] = sim.meep_time()
+        self.n += 1
+
+    def finalize(self, sim):
+        if self.store is not None:
+            self.store.flush()
+
+    @property
+    def frames(self):
+        if self.store is not None:
+            return self.store
+        if self._buffer is None:
+            return np.empty((0,))
+        return self._buffer[:self.n]
+
+    @property
+    def times(self):
+        if self.store is not None:
+            return self.store.times
+        return self._times[:self.n]
+
+class LineProfileObserver(RegionMonitor):
+    """
+    Collects the mean E component along the centre line (x_0:x_end, 0, 0),
+    averaged over rows at offsets -(width-1) .. +(width-1) around the centre.
+    Only the thin strip of 2*width-1 rows is requested from MEEP.
+
+    Attributes:
+        collected_data (np.ndarray): (time, x) array with mean E
+        time_steps (np.ndarray): Time values
+        x_coords (np.ndarray): Array of x coordinates along the line
+    """
+    def __init__(self, singleton_params, delta_t, width=1, until=None, store=None, decimation=None):
+        max_order = max(0, width - 1)
+        strip = 2 * max_order / singleton_params.resolution # zero thickness -> single row
+        out_center, out_size = singleton_params.output_volume()
+        super().__init__(singleton_params, delta_t,
+                         center=mp.Vector3(out_center.x, 0, out_center.z), # in the output plane in 3D
+                         size=mp.Vector3(out_size.x, strip, 0),
+                         until=until, reduce_axis=1, store=store, decimation=decimation)
+        self.width = width
+        self.x_coords = None
+
+    def step(self, sim):
+        super().step(sim)
+        if self.x_coords is None:
+            x, _, _, _ = sim.get_array_metadata(center=self.center, size=self.size)
+            self.x_coords = np.asarray(x) if self.decimation is None else self.decimation.spatial(np.asarray(x))
+
+    @property
+    def collected_data(self):
+        return self.frames
+
+    @property
+    def time_steps(self):
+        return self.times
+
+def full_cell_monitor(singleton_params, delta_t, **kwargs):
+    """
+    Returns a RegionMonitor covering the output volume - the whole cell in 2D, a plane
+    in 3D (use with a FrameStore for long runs).
+    """
+    center, size = singleton_params.output_volume()
+    return RegionMonitor(singleton_params, delta_t, center=center, size=size, **kwargs)
+
+def gap_monitor(singleton_params, delta_t, **kwargs):
+    """
+    Returns a RegionMonitor covering the gap between the two bars.
+    """
+    center, size = singleton_params.output_volume()
+    return RegionMonitor(singleton_params, delta_t, center=center,
+                         size=mp.Vector3(singleton_params.x_width, singleton_params.gap_size, size.z), **kwargs)
+
+class MaxFieldObserver(Observer):
+    """
+    Streaming running max/RMS of |E| over the output volume (see FieldStatsAccumulator),
+    with optional bounded persistence of evenly decimated frames.
+
+    Attributes:
+        stats (FieldStatsAccumulator): The running statistics.
+        saved_frames (np.ndarray): Saved |E| frames (only if save_frames).
+        saved_times (list): Times of the saved frames.
+        store (FrameStore): If set, every |E| frame is also appended to this on-disk store.
+        decimation (Decimation): Reduces the persisted frames (saved_frames and store;
+                                 time_stride applies to the store). The running statistics
+                                 always use every full-resolution frame.
+    """
+    def __init__(self, singleton_params, delta_t, skip_time=0.0, save_frames=False,
+                 max_saved_frames=100, track_time_of_max=False, store=None, decimation=None):
+        # with adaptive stopping the run may last up to max_sim_time - keep accumulating until its end
+        until = singleton_params.max_sim_time if singleton_params.adaptive_stop else singleton_params.animations_until
+        super().__init__(delta_t, start=skip_time, until=until)
+        self.singleton_params = singleton_params
+        self.stats = FieldStatsAccumulator(track_time_of_max=track_time_of_max)
+        self.save_frames = save_frames
+        self.max_saved_frames = max_saved_frames
+        self.store = store
+        self.decimation = decimation
+
+        # Bounded frame persistence: keep every `frame_stride`-th frame in a preallocated buffer
+        n_expected = int(np.ceil((self.until - skip_time) / delta_t)) + 1
+        self.frame_stride = max(1, int(np.ceil(n_expected / max(max_saved_frames, 1))))
+        self.saved_frames = None
+        self.saved_times = []
+        self._frame_counter = 0
+
+    def step(self, sim):
+        current_time = sim.meep_time()
+        center, size = self.singleton_params.output_volume()
+        E_data = sim.get_array(center=center, size=size, component=self.singleton_params.component)
+        self.stats.update(E_data, current_time)
+
+        keep_saved = (self.save_frames and self._frame_counter % self.frame_stride == 0
+                      and len(self.saved_times) < self.max_saved_frames)
+        time_stride = 1 if self.decimation is None else self.decimation.time_stride
+        keep_store = self.store is not None and self._frame_counter % time_stride == 0
+        if keep_saved or keep_store:
+            frame = np.abs(E_data) if self.decimation is None else self.decimation.apply(np.abs(E_data))
+            if keep_store:
+                self.store.append(frame, current_time)
+            if keep_saved:
+                if self.saved_frames is None:
+                    self.saved_frames = np.empty((self.max_saved_frames,) + frame.shape, dtype=frame.dtype)
+                self.saved_frames[len(self.saved_times)] = frame
+                self.saved_times.append(current_time)
+        self._frame_counter += 1
+
+    def finalize(self, sim):
+        if self.store is not None:
+            self.store.flush()
+
+class EpsilonObserver(Observer):
+    """
+    Takes the dielectric constant of the output volume at p.freq once, after the run.
+    """
+    def __init__(self, singleton_params):
+        super().__init__(delta_t=None)
+        self.singleton_params = singleton_params
+        self.data = None
+
+    def step_function(self):
+        return None
+
+    def finalize(self, sim):
+        center, size = self.singleton_params.output_volume()
+        self.data = sim.get_array(component=mp.Dielectric, center=center, size=size,
+                                  frequency=self.singleton_params.freq)
+
+class FinalFieldObserver(Observer):
+    """
+    Takes a snapshot of the E component on the output volume at time `at_time`
+    (or at the end of the run if `at_time` is None or not reached).
+    """
+    def __init__(self, singleton_params, at_time=None):
+        super().__init__(delta_t=None)
+        self.singleton_params = singleton_params
+        self.at_time = at_time
+        self.data = None
+        self.time = None
+
+    def step_function(self):
+        if self.at_time is None:
+            return None
+        return mp.at_time(self.at_time, self.step)
+
+    def step(self, sim):
+        if self.data is None:
+            center, size = self.singleton_params.output_volume()
+            self.data = sim.get_array(center=center, size=size, component=self.singleton_params.component)
+            self.time = sim.meep_time()
+
+    def finalize(self, sim):
+        self.step(sim)
+
+def run_observers(sim, observers, until=None, reset=True, checkpoint=None):
+    """
+    Runs the simulation once from t=0 and feeds all observers during that single pass.
+
+    Args:
+        sim (mp.Simulation): The simulation to run.
+        observers (list of Observer): Observers to feed.
+        until (float): Run time; defaults to the latest `until` or `at_time` of the observers
+                       (required if none of them has one).
+        reset (bool): Start from t=0. With reset=False the run continues from the current
+                      state, e.g. a steady state loaded by Checkpointer.branch().
+        checkpoint (Checkpointer): If set, the run is checkpointed periodically and
+                                   resumed from the last checkpoint if there is one.
+
+    Returns:
+        list of Observer: The same observers, finalized.
+    """
+    if until is None:
+        ends = ([o.until for o in observers if o.until is not None]
+                + [o.at_time for o in observers if getattr(o, "at_time", None) is not None])
+        if not ends:
+            raise ValueError("run_observers() needs `until` when no observer has an `until` or `at_time`.")
+        until = max(ends)
+
+    step_funcs = [f for f in (o.step_function() for o in observers) if f is not None]
+    try:
+        if checkpoint is not None:
+            checkpoint.run(sim, until, step_funcs=step_funcs, observers=observers, label="run_observers")
+        else:
+            if reset:
+                sim.reset_meep()
+            elif sim.fields is not None:
+                # continuing run: observer windows are relative to its start
+                t0 = sim.meep_time()
+                for o in observers:
+                    o.start += t0
+                    if o.until is not None:
+                        o.until += t0
+                    if getattr(o, "at_time", None) is not None:
+                        o.at_time += t0
+                step_funcs = [f for f in (o.step_function() for o in observers) if f is not None]
+            timed_run(sim, "run_observers", *step_funcs, until=until)
+
+        for o in observers:
+            o.finalize(sim)
+    finally:
+        # e.g. the ffmpeg process of a VideoObserver must not outlive a failed run
+        for o in observers:
+            o.close()
+    return observers
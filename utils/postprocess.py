@@ -0,0 +1,169 @@
+## Out-of-core post-processing of saved enhancement data and frame stores
+## (pure NumPy - no MEEP needed, nothing is re-simulated)
+import os
+import csv
+import json
+import numpy as np
+
+from utils.frame_store import FrameStore
+
+ENHANCEMENT_FILE = "data_enhancement.npz"
+PARAMS_FILE = "simulation_params.json"
+
+def load_enhancement(path):
+    """
+    Opens <path>/data_enhancement.npz lazily - arrays are only read when accessed.
+    Use as a context manager or close() it.
+    """
+    return np.load(os.path.join(path, ENHANCEMENT_FILE))
+
+def load_params(path):
+    """
+    Parameters of a results directory from the lossless simulation_params.json (or None).
+    """
+    fname = os.path.join(path, PARAMS_FILE)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)["params"]
+
+def gain_map(E_with, E_without):
+    """
+    Linear gain |E_with| / |E_without|; NaN where the reference is zero (e.g. the masked PML frame).
+    """
+    E_with = np.asarray(E_with, dtype=float)
+    E_without = np.asarray(E_without, dtype=float)
+    gain = np.full(np.broadcast(E_with, E_without).shape, np.nan)
+    np.divide(E_with, E_without, out=gain, where=E_without != 0)
+    return gain
+
+def to_db(gain):
+    """
+    Field gain in dB: 20*log10(gain).
+    """
+    return 20.0 * np.log10(gain + 1e-12)
+
+def percentile_clip(data, low=1, high=99):
+    """
+    Clips outliers to the [low, high] percentiles (NaNs ignored).
+
+    Returns:
+        clipped (np.ndarray), vmin (float), vmax (float)
+    """
+    vmin = np.nanpercentile(data, low)
+    vmax = np.nanpercentile(data, high)
+    return np.clip(data, vmin, vmax), vmin, vmax
+
+def gap_mask(shape, params):
+    """
+    Boolean mask of the gap between the bars (|x| < x_width/2, |y| < gap_size/2)
+    for a map of the given shape covering the output volume (the whole cell by default).
+    """
+    nx, ny = shape[:2]
+    size = params.get("output_size") or params["xyz_cell"]
+    x0, y0 = (params.get("output_center") or [0, 0])[:2]
+    x = x0 + np.linspace(-size[0]/2, size[0]/2, nx)
+    y = y0 + np.linspace(-size[1]/2, size[1]/2, ny)
+    # at least the row/column nearest to the centre, even for a gap narrower than a pixel
+    half_x = max(params["x_width"]/2, (x[1] - x[0])/2 if nx > 1 else 0)
+    half_y = max(params["gap_size"]/2, (y[1] - y[0])/2 if ny > 1 else 0)
+    return (np.abs(x)[:, None] <= half_x) & (np.abs(y)[None, :] <= half_y)
+
+def gap_statistics(gain, params=None):
+    """
+    Statistics of a gain map in the gap (or only at its centre without parameters).
+    """
+    stats = {"center": float(gain[gain.shape[0] // 2, gain.shape[1] // 2])}
+    if params is not None:
+        values = gain[gap_mask(gain.shape, params)]
+        values = values[np.isfinite(values)]
+        if values.size:
+            stats.update(mean=float(np.mean(values)), median=float(np.median(values)),
+                         min=float(np.min(values)), max=float(np.max(values)))
+    return stats
+
+def streaming_histogram(chunks, bins=200, value_range=None):
+    """
+    Histogram accumulated chunk by chunk (constant memory). Without value_range the
+    chunks are iterated twice (first pass finds the range), so pass a callable
+    returning a fresh iterator, e.g. `lambda: (b for _, b in store.iter_chunks())`.
+
+    Returns:
+        counts (np.ndarray), edges (np.ndarray)
+    """
+    if value_range is None:
+        lo, hi = np.inf, -np.inf
+        for block in chunks():
+            block = np.asarray(block)
+            finite = block[np.isfinite(block)]
+            if finite.size:
+                lo, hi = min(lo, finite.min()), max(hi, finite.max())
+        value_range = (lo, hi)
+    counts = np.zeros(bins, dtype=np.int64)
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+    for block in (chunks() if callable(chunks) else chunks):
+        counts += np.histogram(np.asarray(block), bins=edges)[0]
+    return counts, edges
+
+def histogram_percentiles(counts, edges, q):
+    """
+    Approximate percentiles from a (streaming) histogram.
+    """
+    cdf = np.cumsum(counts) / max(np.sum(counts), 1)
+    centers = 0.5 * (edges[1:] + edges[:-1])
+    return np.interp(np.asarray(q) / 100.0, cdf, centers)
+
+def store_statistics(store):
+    """
+    Running max and RMS of |E| over a FrameStore, reading one chunk at a time.
+    """
+    if isinstance(store, str):
+        store = FrameStore(store)
+    E_max, E_sq_sum, n = None, None, 0
+    for _, block in store.iter_chunks():
+        block = np.abs(block)
+        if E_max is None:
+            E_max = np.zeros(block.shape[1:])
+            E_sq_sum = np.zeros(block.shape[1:])
+        np.maximum(E_max, block.max(axis=0), out=E_max)
+        E_sq_sum += np.sum(block.astype(float)**2, axis=0)
+        n += block.shape[0]
+    return E_max, (np.sqrt(E_sq_sum / n) if n else None)
+
+def process_results(path, bins=200):
+    """
+    Gain map, dB map, gap statistics and histogram of one results directory.
+    Writes <path>/gain_statistics.json and returns the statistics.
+    """
+    params = load_params(path)
+    with load_enhancement(path) as data:
+        gain = gain_map(data["E_max_with"], data["E_max_without"])
+    gain_db = to_db(gain)
+    counts, edges = streaming_histogram([gain_db[np.isfinite(gain_db)]], bins=bins,
+                                        value_range=(np.nanmin(gain_db), np.nanmax(gain_db)))
+    stats = {"gap_gain": gap_statistics(gain, params),
+             "gap_gain_db": gap_statistics(gain_db, params),
+             "gain_db_percentiles": dict(zip(["p1", "p50", "p99"],
+                                             histogram_percentiles(counts, edges, [1, 50, 99]).tolist()))}
+    with open(os.path.join(path, "gain_statistics.json"), "w") as f:
+        json.dump(stats, f, indent=2)
+    np.savez(os.path.join(path, "gain_histogram.npz"), counts=counts, edges=edges)
+    return stats
+
+def process_results_tree(root, bins=200):
+    """
+    Runs process_results() on every directory below root that contains a
+    data_enhancement.npz (e.g. a whole sweep) and writes root/gain_summary.csv.
+    """
+    rows = []
+    for dirpath, _, files in sorted(os.walk(root)):
+        if ENHANCEMENT_FILE in files:
+            stats = process_results(dirpath, bins=bins)
+            rows.append([os.path.relpath(dirpath, root),
+                         stats["gap_gain"]["center"], stats["gap_gain"].get("mean", ""),
+                         stats["gap_gain_db"]["center"], stats["gain_db_percentiles"]["p99"]])
+    with open(os.path.join(root, "gain_summary.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["run", "gap_gain_center", "gap_gain_mean", "gap_gain_db_center", "gain_db_p99"])
+        writer.writerows(rows)
+    return rows
@@ -1,3 +1,6 @@
+from utils.mpi_utils import master_only
+
+@master_only
 def print_task(task_number, description=None):
     title = f"## TASK {task_number} ##"
     border = "#" * len(title)
@@ -0,0 +1,139 @@
+## Per-task performance instrumentation: wall time per stage, timesteps/s,
+## callback overhead and peak RSS, written as a JSON report
+import os
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+REPORT_FILE = "telemetry_report.json"
+
+# Stages recorded by the instrumented code. Stages are exclusive: the time of a stage
+# nested in another (e.g. io in a callback in stepping) only counts for the inner one.
+#   geometry_init - building the simulation and voxelising the structure
+#   stepping      - sim.run() without the callbacks, i.e. MEEP's own time stepping
+#   callbacks     - observer step functions (get_array and their reductions) called during stepping
+#   io            - np.savez, cache and frame store writes (only queueing them if utils.async_io is enabled)
+#   io_flush      - waiting for the background output worker at the end of a task
+#   plotting      - matplotlib figures and animations
+STAGES = ("geometry_init", "stepping", "callbacks", "io", "io_flush", "plotting")
+
+# tasks currently running (outermost first) and finished tasks not yet written
+_active = []
+_finished = {}
+
+# per thread: time spent in the nested stages of every running stage (innermost last)
+_nesting = threading.local()
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far in MB (None if unavailable) - the
+    high-water mark over the whole process lifetime, it never goes down.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024**2 if os.uname().sysname == "Darwin" else rss / 1024
+
+def add(stage, seconds):
+    """
+    Adds `seconds` to a stage of every running task (a nested task also counts for its parent).
+    """
+    for record in _active:
+        record["stages"][stage] = record["stages"].get(stage, 0.0) + seconds
+
+def add_timesteps(n):
+    for record in _active:
+        record["timesteps"] += n
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the enclosed block as stage `name`. Usable as `with stage("io"):` or as a decorator.
+    The time of stages nested inside is subtracted (see STAGES).
+    """
+    stack = _nesting.__dict__.setdefault("stack", [])
+    stack.append(0.0)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        add(name, elapsed - stack.pop())
+        if stack:
+            stack[-1] += elapsed
+
+@contextlib.contextmanager
+def task(name):
+    """
+    Records the wall time, the stages and the RSS high-water mark of the enclosed task.
+    The record is kept until write_report() is called.
+    """
+    record = {"stages": {}, "timesteps": 0, "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "_rss_start_mb": peak_rss_mb()}
+    _active.append(record)
+    t0 = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _active.remove(record)
+        record["wall_s"] = time.perf_counter() - t0
+        _finished[name] = summarize(record)
+
+def summarize(record):
+    """
+    Derived figures of a task record: timesteps per second of pure stepping, callback
+    overhead (callback time per second of pure stepping), the time not covered by any stage,
+    the process peak RSS (lifetime high-water mark) and by how much the task raised it.
+    """
+    stages = record["stages"]
+    stepping = stages.get("stepping", 0.0)
+    callbacks = stages.get("callbacks", 0.0)
+    rss_start, rss_end = record.pop("_rss_start_mb", None), peak_rss_mb()
+    record.update(timesteps_per_s=record["timesteps"] / stepping if stepping > 0 else None,
+                  callback_overhead=callbacks / stepping if stepping > 0 else None,
+                  other_s=max(0.0, record["wall_s"] - sum(stages.values())),
+                  process_peak_rss_mb=rss_end,
+                  peak_rss_growth_mb=rss_end - rss_start if rss_end is not None else None)
+    return record
+
+def write_report(filename):
+    """
+    Merges the finished tasks into the JSON report `filename` (one entry per task name,
+    the latest run wins) and forgets them. Only the master rank writes; concurrent
+    processes (parallel pipeline stages) are serialised by a lock file.
+    """
+    from utils.mpi_utils import am_master # mpi_utils itself imports this module
+
+    if not am_master():
+        clear()
+        return
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename + ".lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        report = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                report = json.load(f)
+        report.update(_finished)
+        with open(filename, "w") as f:
+            json.dump(report, f, indent=2)
+    clear()
+
+def clear():
+    """
+    Forgets the finished tasks without writing them.
+    """
+    _finished.clear()
@@ -0,0 +1,132 @@
+## Streaming animations: raw field frames are colour-mapped with NumPy and piped
+## straight into an ffmpeg subprocess (constant memory, no matplotlib per frame)
+import shutil
+import subprocess
+import numpy as np
+
+from utils.frame_store import FrameStore
+
+def colormap_lut(cmap="RdBu", n=256):
+    """
+    (n, 3) uint8 lookup table of a matplotlib colormap (matplotlib is only used here, once).
+    """
+    import matplotlib.pyplot as plt
+    colors = plt.get_cmap(cmap)(np.linspace(0.0, 1.0, n))[:, :3]
+    return np.round(colors * 255).astype(np.uint8)
+
+def apply_lut(frame, lut, vmin, vmax, overlay=None):
+    """
+    Maps a 2D (x, y) field frame to an RGB image (rows = y, like show_data_img).
+
+    Args:
+        frame (np.ndarray): 2D field (real part is used).
+        lut (np.ndarray): (n, 3) uint8 colour table, see colormap_lut().
+        vmin, vmax (float): Values mapped to the first / last colour.
+        overlay (np.ndarray): Optional boolean (x, y) mask drawn dark (e.g. the metal bars).
+
+    Returns:
+        np.ndarray: (ny, nx, 3) uint8 image.
+    """
+    scale = (len(lut) - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    idx = np.clip((np.real(frame) - vmin) * scale, 0, len(lut) - 1).astype(np.intp)
+    rgb = lut[idx.T]
+    if overlay is not None:
+        rgb[overlay.T] //= 4
+    return rgb
+
+class VideoWriter:
+    """
+    Writes RGB frames to an mp4 through an ffmpeg pipe, one frame at a time.
+    Odd image sizes are padded (yuv420p needs even sizes); small grids can be
+    enlarged by an integer `upscale` factor (nearest neighbour).
+
+    Example:
+        >>> with VideoWriter("Ey.mp4", fps=10) as video:
+        ...     for frame in frames:
+        ...         video.write(apply_lut(frame, lut, -1, 1))
+    """
+    def __init__(self, filename, fps=10, upscale=1, codec="libx264", crf=18, ffmpeg="ffmpeg"):
+        if shutil.which(ffmpeg) is None:
+            raise RuntimeError(f"'{ffmpeg}' not found - it is needed to encode {filename}.")
+        self.filename = filename
+        self.fps = fps
+        self.upscale = int(upscale)
+        self.codec = codec
+        self.crf = crf
+        self.ffmpeg = ffmpeg
+        self.n_frames = 0
+        self._proc = None
+        self._size = None
+
+    def _open(self, width, height):
+        self._size = (width, height)
+        cmd = [self.ffmpeg, "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+               "-c:v", self.codec, "-crf", str(self.crf), "-pix_fmt", "yuv420p", self.filename]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, rgb):
+        """
+        Appends one (height, width, 3) uint8 image.
+        """
+        if self.upscale > 1:
+            rgb = np.repeat(np.repeat(rgb, self.upscale, axis=0), self.upscale, axis=1)
+        pad_h, pad_w = rgb.shape[0] % 2, rgb.shape[1] % 2
+        if pad_h or pad_w:
+            rgb = np.pad(rgb, ((0, pad_h), (0, pad_w), (0, 0)), mode="edge")
+        if self._proc is None:
+            self._open(rgb.shape[1], rgb.shape[0])
+        elif (rgb.shape[1], rgb.shape[0]) != self._size:
+            raise ValueError(f"Frame size {rgb.shape[1]}x{rgb.shape[0]} differs from the video size {self._size}.")
+        self._proc.stdin.write(np.ascontiguousarray(rgb, dtype=np.uint8).tobytes())
+        self.n_frames += 1
+
+    def close(self):
+        if self._proc is None:
+            return
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing {self.filename} (exit code {self._proc.returncode}).")
+        self._proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def render_store(store, filename, fps=10, cmap="RdBu", vmin=None, vmax=None,
+                 stride=1, upscale=1, overlay=None):
+    """
+    Encodes a FrameStore (or its path) into an mp4 without re-simulating.
+    Without vmin/vmax a first pass over the chunks finds the colour range
+    (symmetric around zero for signed fields); memory stays at one chunk.
+
+    Args:
+        stride (int): Use every stride-th frame.
+        overlay (np.ndarray): Optional boolean (x, y) mask drawn dark, e.g. the bars.
+
+    Returns:
+        int: Number of encoded frames.
+    """
+    if isinstance(store, str):
+        store = FrameStore(store)
+    if vmin is None or vmax is None:
+        lo, hi = np.inf, -np.inf
+        for _, block in store.iter_chunks():
+            block = np.real(block)
+            lo, hi = min(lo, float(np.min(block))), max(hi, float(np.max(block)))
+        if lo < 0:
+            hi = max(-lo, hi)
+            lo = -hi
+        vmin = lo if vmin is None else vmin
+        vmax = hi if vmax is None else vmax
+
+    lut = colormap_lut(cmap)
+    first = 0 # index of the first frame of the chunk
+    with VideoWriter(filename, fps=fps, upscale=upscale) as video:
+        for _, block in store.iter_chunks():
+            for i in range((-first) % stride, len(block), stride):
+                video.write(apply_lut(block[i], lut, vmin, vmax, overlay))
+            first += len(block)
+    return video.n_frames
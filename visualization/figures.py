@@ -0,0 +1,135 @@
+## Figure helpers of the tasks: drawing, saving and the FigureQueue render pool.
+## No MEEP import here - spawned render workers must not initialise MPI.
+import concurrent.futures
+import multiprocessing
+import numpy as np
+
+from visualization.plotter import *
+from utils.mpi_utils import master_only, count_ranks, set_serial
+from utils import telemetry
+from utils import async_io
+
+def finish_figure(filename=None, IMG_CLOSE=False, dpi=300):
+    """
+    Saves the current figure as PNG and shows it - for 2 s if IMG_CLOSE, otherwise until
+    the window is closed. With IMG_CLOSE the figure is closed first and its PNG is encoded
+    in the background output worker (utils.async_io) on a fresh Agg canvas, detached from
+    pyplot, while the simulation continues.
+    In headless mode (see set_headless()) the figure is only saved, never shown.
+    """
+    fig = plt.gcf()
+    if is_headless():
+        plt.close(fig)
+        if filename is not None:
+            async_io.savefig(fig, filename, dpi=dpi, bbox_inches="tight", format="png")
+        return
+    if not IMG_CLOSE:
+        if filename is not None:
+            fig.savefig(filename, dpi=dpi, bbox_inches="tight", format="png")
+        plt.show()
+        return
+    plt.show(block=False)
+    plt.pause(2)
+    plt.close(fig)
+    if filename is not None:
+        async_io.savefig(fig, filename, dpi=dpi, bbox_inches="tight", format="png")
+
+def _init_render_worker():
+    set_serial()
+    set_headless()
+
+class FigureQueue:
+    """
+    Plotting calls of a task (e.g. show_data_img, plot_e_3d with a file name to save to).
+    With processes > 0 (headless mode without MPI only) add() just records the calls and
+    render() draws all figures in a process pool; otherwise every call is drawn right away.
+    The workers only import this module and matplotlib, never MEEP.
+
+    Example:
+        >>> figures = FigureQueue(processes=4)
+        >>> figures.add(show_data_img, datas_arr=[E], ..., name_to_save="Max_E")
+        >>> figures.render()
+    """
+    def __init__(self, processes=0):
+        # a process spawned by an MPI rank must not initialise MPI itself - draw inline then
+        self.processes = processes if is_headless() and count_ranks() == 1 else 0
+        self.jobs = []
+
+    def add(self, func, *args, **kwargs):
+        if self.processes > 0:
+            self.jobs.append((func, args, kwargs))
+        else:
+            func(*args, **kwargs)
+
+    @master_only
+    @telemetry.stage("plotting")
+    def render(self):
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return
+        # spawn: forking an MPI/MEEP process is unsafe
+        ctx = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.processes, len(jobs)), mp_context=ctx,
+                                                    initializer=_init_render_worker) as pool:
+            for future in [pool.submit(func, *args, **kwargs) for func, args, kwargs in jobs]:
+                future.result()
+
+@master_only
+@telemetry.stage("plotting")
+def show_data_img(datas_arr, abs_bool, norm_bool, cmap_arr, alphas, name_to_save=None, IMG_CLOSE=False):
+    """
+    Displays a series of images from a given array of data.
+
+    Parameters:
+    datas_arr (list of np.ndarray): A list of 2D arrays containing the data to be visualized.
+    norm_bool (list of bool): A list of boolean values indicating whether to normalize each corresponding data array.
+    cmap_arr (list of str): A list of colormap names to be used for each corresponding data array.
+    alphas (list of float): A list of alpha values for transparency for each corresponding data array.
+
+    The function iterates through the provided data arrays, normalizes them if specified, 
+    and displays each image using matplotlib's imshow function with the specified colormap 
+    and transparency settings. The x and y axis ticks are turned off for a cleaner visualization.
+    """
+    for idx, data in enumerate(datas_arr):
+        if abs_bool[idx]:
+            data = np.abs(data) # complex -> real
+        if norm_bool[idx]:
+            max_data = np.max(data)
+            data = data / max_data # complex -> real
+        plt.imshow(data.transpose(), interpolation="spline36", cmap=cmap_arr[idx], alpha=alphas[idx])
+        plt.xticks([])  # Turn off x-axis numbers
+        plt.yticks([])  # Turn off y-axis numbers
+        plt.colorbar(shrink=0.6)  # Show color scale
+    finish_figure(None if name_to_save is None else f"{name_to_save}.png", IMG_CLOSE)
+    
+@master_only
+@telemetry.stage("plotting")
+def plot_e_3d(collected_data, x_coords, time_steps, name=None, IMG_CLOSE=False):
+    """
+    Plot E component in 3D: x axis, time axis, z axis (E magnitude)
+    
+    Args:
+        collected_data: List of E field arrays at each time step
+        x_coords: Array of x coordinates
+        time_steps: List of time values
+    """   
+    # Create meshgrid for 3D plot
+    X, T = np.meshgrid(x_coords, time_steps)
+    Z = np.abs(np.array(collected_data))
+    
+    fig = plt.figure(figsize=(14, 8))
+    ax = fig.add_subplot(111, projection='3d')
+    
+    # Plot surface
+    surf = ax.plot_surface(X, T, Z, cmap='viridis', alpha=0.9, edgecolor='none')
+    
+    ax.set_xlabel('x coordinate')
+    ax.set_ylabel('time')
+    ax.set_zlabel('|Ey|')
+    ax.set_title('Ey Component vs Time')
+    
+    fig.colorbar(surf, ax=ax, shrink=0.5, aspect=5)
+    
+    # Adjust viewpoint: elev controls vertical angle, azim controls horizontal angle
+    ax.view_init(elev=20, azim=45)
+    finish_figure(name, IMG_CLOSE)
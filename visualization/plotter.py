@@ -5,6 +5,28 @@ import numpy as np
 
 from mpl_toolkits.mplot3d import Axes3D
 
+# Headless batch mode - see set_headless()
+_headless = False
+_previous_backend = None # backend to restore when headless mode is switched off
+
+def set_headless(enabled=True):
+    """
+    Headless batch mode: the non-interactive Agg backend is used and figures are only
+    written to files (no windows, no display pauses), e.g. on compute nodes without a display.
+    set_headless(False) restores the backend used before.
+    """
+    global _headless, _previous_backend
+    if enabled and not _headless:
+        _previous_backend = plt.get_backend()
+        plt.switch_backend("Agg")
+    elif not enabled and _headless and _previous_backend is not None:
+        plt.switch_backend(_previous_backend)
+        _previous_backend = None
+    _headless = enabled
+
+def is_headless():
+    return _headless
+
 # Global settings for plotting
 
 ## Font